@@ -0,0 +1,130 @@
+"""Offline benchmarks for the RAGulea vector search code.
+
+Runs on synthetic embeddings, no MongoDB or Ollama needed:
+
+    python benchmark.py search --sizes 10000 100000 1000000 --dim 1024
+    python benchmark.py quantization --size 200000 --dim 1024 --k 10
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from vector_index import FlatIndex, IVFIndex, normalize
+
+
+def cosine_similarity(a, b):
+    # Same per-document scoring the chat endpoint used before the vector indexes
+    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+
+
+def synthetic_embeddings(n, dim, seed=0, batch_size=100000):
+    """Clustered random vectors, closer to real embeddings than pure noise"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, n // 1000), dim)).astype(np.float32)
+    vectors = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, batch_size):
+        end = min(start + batch_size, n)
+        labels = rng.integers(0, len(centers), end - start)
+        vectors[start:end] = centers[labels] + 0.5 * rng.standard_normal((end - start, dim)).astype(np.float32)
+    return vectors
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def bench_search(args):
+    print(f"{'chunks':>9} | {'python loop':>12} | {'flat':>9} | {'flat mmap':>9} | {'flat x32':>9} | {'ivf':>9} | {'speedup':>8}")
+    for n in args.sizes:
+        vectors = synthetic_embeddings(n, args.dim)
+        queries = vectors[np.random.default_rng(1).choice(n, 32, replace=False)]
+        query = queries[0]
+
+        # The old loop decodes each document into a Python list; at large sizes that
+        # does not fit in memory, so time a sample and extrapolate (the loop is linear)
+        sample = min(n, args.loop_sample)
+        docs = [vectors[i].tolist() for i in range(sample)]
+        loop_time, _ = timed(lambda: sorted(
+            (cosine_similarity(query, doc) for doc in docs), reverse=True
+        )[:args.k], 1)
+        loop_time *= n / sample
+        del docs
+
+        ids = list(range(n))
+        flat = FlatIndex.from_matrix(ids, vectors)
+        flat_time, _ = timed(lambda: flat.search(query, args.k), args.repeat)
+        batch_time, _ = timed(lambda: flat.search_batch(queries, args.k), args.repeat)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "vectors.npy")
+            np.save(path, normalize(vectors))
+            mapped = FlatIndex.from_matrix(ids, np.load(path, mmap_mode="r"), normalized=True)
+            mmap_time, _ = timed(lambda: mapped.search(query, args.k), args.repeat)
+            del mapped
+
+        ivf = IVFIndex.from_matrix(ids, vectors, nprobe=args.nprobe, min_train_size=1)
+        ivf_time, _ = timed(lambda: ivf.search(query, args.k), args.repeat)
+
+        print(f"{n:>9} | {loop_time * 1000:>10.1f}ms | {flat_time * 1000:>7.2f}ms | {mmap_time * 1000:>7.2f}ms | "
+              f"{batch_time * 1000 / len(queries):>7.2f}ms | {ivf_time * 1000:>7.2f}ms | {loop_time / flat_time:>7.0f}x")
+    print("flat x32 = per-query time when 32 queries are scored as one batch; speedup = python loop / flat")
+
+
+def bench_quantization(args):
+    vectors = synthetic_embeddings(args.size, args.dim)
+    queries = vectors[np.random.default_rng(1).choice(args.size, args.queries, replace=False)]
+    queries = queries + 0.1 * np.random.default_rng(2).standard_normal(queries.shape).astype(np.float32)
+    ids = list(range(args.size))
+    exact = FlatIndex.from_matrix(ids, vectors)
+    truth = [set(i for _, i in hits) for hits in exact.search_batch(queries, args.k)]
+
+    print(f"{'mode':>6} | {'rerank':>6} | {'recall@' + str(args.k):>9} | {'codes':>9} | {'vectors':>9} | {'latency':>9}")
+    for mode in args.modes:
+        quantization = None if mode == "none" else mode
+        for rerank_factor in (args.rerank_factors if quantization else [0]):
+            index = FlatIndex.from_matrix(ids, vectors, quantization=quantization, rerank_factor=rerank_factor,
+                                          pq_subspaces=args.pq_subspaces)
+            elapsed, _ = timed(lambda: [index.search(q, args.k) for q in queries], 1)
+            found = [set(i for _, i in index.search(q, args.k)) for q in queries]
+            recall = np.mean([len(f & t) / len(t) for f, t in zip(found, truth)])
+            memory = index.memory_usage
+            print(f"{mode:>6} | {rerank_factor or '-':>6} | {recall:>9.3f} | {memory['codes'] / 2**20:>7.1f}MB | "
+                  f"{memory['vectors'] / 2**20:>7.1f}MB | {elapsed * 1000 / len(queries):>7.2f}ms")
+    print("recall against exact float32 search; latency per query, including the exact re-rank of k * rerank candidates")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    search = commands.add_parser("search", help="Python loop vs. vectorized exact vs. IVF search")
+    search.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    search.add_argument("--dim", type=int, default=1024)
+    search.add_argument("--k", type=int, default=5)
+    search.add_argument("--nprobe", type=int, default=32)
+    search.add_argument("--repeat", type=int, default=5)
+    search.add_argument("--loop-sample", type=int, default=20000)
+    search.set_defaults(run=bench_search)
+
+    quantization = commands.add_parser("quantization", help="Recall@k, memory and latency of int8 / PQ first passes")
+    quantization.add_argument("--size", type=int, default=200000)
+    quantization.add_argument("--dim", type=int, default=1024)
+    quantization.add_argument("--k", type=int, default=10)
+    quantization.add_argument("--queries", type=int, default=100)
+    quantization.add_argument("--modes", nargs="+", default=["none", "int8", "pq"], choices=["none", "int8", "pq"])
+    quantization.add_argument("--rerank-factors", type=int, nargs="+", default=[4, 16])
+    quantization.add_argument("--pq-subspaces", type=int, default=None)
+    quantization.set_defaults(run=bench_quantization)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
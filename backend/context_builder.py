@@ -0,0 +1,127 @@
+"""Assembly of the LLM context from retrieved chunks.
+
+Consecutive chunks of a file share up to `chunk_overlap` characters, so
+chunks whose end and start overlap are merged back into one passage;
+passages that repeat each other are dropped, and what is left is packed
+into a token budget in rank order.
+"""
+import math
+import re
+
+CHARS_PER_TOKEN = 4  # Rough average for English/Romanian text with Llama-style tokenizers
+MIN_OVERLAP = 20  # Shortest suffix/prefix match treated as splitter overlap
+MAX_OVERLAP = 400  # Longest overlap searched for (chunk_overlap is 200)
+SHINGLE_SIZE = 5  # Words per shingle for near-duplicate detection
+DUPLICATE_SIMILARITY = 0.8  # Jaccard similarity of shingles above which a passage is dropped
+MIN_PASSAGE_TOKENS = 64  # A passage is only truncated to fit if at least this much of it fits
+
+SENTENCE_END_RE = re.compile(r"[.!?]\s|\n")
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def overlap_length(a, b, min_overlap=MIN_OVERLAP, max_overlap=MAX_OVERLAP):
+    """Length of the longest suffix of `a` that is also a prefix of `b` (0 below `min_overlap`)"""
+    if len(a) < min_overlap or len(b) < min_overlap:
+        return 0
+    head = b[:min_overlap]
+    start = max(0, len(a) - max_overlap)
+    pos = a.find(head, start)
+    while pos != -1:
+        if b.startswith(a[pos:]):
+            return len(a) - pos
+        pos = a.find(head, pos + 1)
+    return 0
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    words = text.lower().split()
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def merge_overlapping(passages):
+    """Merge passages of the same source whose texts overlap end-to-start.
+
+    `passages` are (source, text) in rank order; returns (source, text) in the
+    order of each group's best-ranked member, and the number of merges.
+    """
+    merged = [list(p) for p in passages]
+    merges = 0
+    changed = True
+    while changed:
+        changed = False
+        for i, first in enumerate(merged):
+            for j, second in enumerate(merged):
+                if i == j or first[0] != second[0]:
+                    continue
+                overlap = overlap_length(first[1], second[1])
+                if overlap:
+                    # Keep the merged passage at the better rank of the two
+                    keep, drop = (i, j) if i < j else (j, i)
+                    merged[keep] = [first[0], first[1] + second[1][overlap:]]
+                    del merged[drop]
+                    merges += 1
+                    changed = True
+                    break
+            if changed:
+                break
+    return [tuple(p) for p in merged], merges
+
+
+def drop_duplicates(passages, similarity=DUPLICATE_SIMILARITY):
+    """Remove passages contained in or nearly identical to a better-ranked one; returns (kept, dropped)"""
+    kept, kept_shingles, dropped = [], [], 0
+    for source, text in passages:
+        current = shingles(text)
+        duplicate = False
+        for (_, other_text), other in zip(kept, kept_shingles):
+            if text in other_text or len(current & other) / max(1, len(current | other)) >= similarity:
+                duplicate = True
+                break
+        if duplicate:
+            dropped += 1
+            continue
+        kept.append((source, text))
+        kept_shingles.append(current)
+    return kept, dropped
+
+
+def truncate_to_tokens(text, tokens):
+    """Cut `text` to about `tokens` tokens, at a sentence end when there is one"""
+    limit = tokens * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    ends = [m.end() for m in SENTENCE_END_RE.finditer(text, 0, limit)]
+    return text[:ends[-1]].rstrip() if ends else text[:limit].rstrip()
+
+
+def build_context(passages, token_budget, separator="\n\n"):
+    """Merge, de-duplicate and pack (source, text) passages in rank order into `token_budget` tokens.
+
+    Returns (context text, stats).
+    """
+    stats = {"passages": len(passages), "raw_tokens": estimate_tokens(separator.join(t for _, t in passages))}
+    merged, stats["merged"] = merge_overlapping(passages)
+    unique, stats["duplicates"] = drop_duplicates(merged)
+    parts, used, truncated, skipped = [], 0, 0, 0
+    separator_tokens = estimate_tokens(separator)
+    for _, text in unique:
+        remaining = token_budget - used - (separator_tokens if parts else 0)
+        tokens = estimate_tokens(text)
+        if tokens > remaining:
+            if remaining < MIN_PASSAGE_TOKENS:
+                skipped += 1
+                continue
+            text = truncate_to_tokens(text, remaining)
+            tokens = estimate_tokens(text)
+            truncated += 1
+        parts.append(text)
+        used += tokens + (separator_tokens if len(parts) > 1 else 0)
+    context = separator.join(parts)
+    stats.update(passages_used=len(parts), truncated=truncated, skipped=skipped,
+                 context_tokens=estimate_tokens(context), token_budget=token_budget)
+    return context, stats
@@ -0,0 +1,391 @@
+"""Text extraction for uploaded files.
+
+Kept free of FastAPI/MongoDB state so the functions here can run in worker
+processes (see the parse pool in main.py).
+"""
+import io
+import os
+import shutil
+import tempfile
+import traceback
+import zipfile
+from concurrent.futures import as_completed
+
+import fitz  # PyMuPDF
+
+try:
+    from docx import Document as DocxDocument
+    DOCX_AVAILABLE = True
+except ImportError:
+    DOCX_AVAILABLE = False
+try:
+    from openpyxl import load_workbook
+    EXCEL_AVAILABLE = True
+except ImportError:
+    EXCEL_AVAILABLE = False
+try:
+    import pytesseract
+    from PIL import Image
+    # Set Tesseract path for Windows
+    if os.name == 'nt':
+        tesseract_paths = [
+            r"C:\Program Files\Tesseract-OCR\tesseract.exe",
+            r"C:\Program Files (x86)\Tesseract-OCR\tesseract.exe"
+        ]
+        for path in tesseract_paths:
+            if os.path.exists(path):
+                pytesseract.pytesseract.tesseract_cmd = path
+                break
+    OCR_AVAILABLE = True
+except ImportError:
+    OCR_AVAILABLE = False
+
+# OCR settings
+OCR_LANGUAGES = 'ron+eng'  # Romanian + English
+OCR_TARGET_PIXELS = 2340  # Long edge of the rendered page: 200 DPI for A4 (as before), ~210 DPI for Letter
+OCR_MIN_DPI = 150
+OCR_MAX_DPI = 400
+OCR_PAGES_PER_TASK = 4  # Pages handed to a worker process at a time
+
+TEXT_EXTENSIONS = (".txt", ".md", ".markdown")
+CODE_EXTENSIONS = (".py", ".js", ".jsx", ".ts", ".tsx", ".java", ".cpp", ".c", ".h", ".cs", ".go", ".rs", ".rb", ".php")
+CONFIG_EXTENSIONS = (".json", ".xml", ".yaml", ".yml", ".toml", ".ini", ".cfg", ".conf")
+WEB_EXTENSIONS = (".html", ".htm", ".css", ".scss", ".sass")
+TABLE_EXTENSIONS = (".csv", ".tsv")
+WORD_EXTENSIONS = (".docx", ".doc")
+EXCEL_EXTENSIONS = (".xlsx", ".xls")
+
+IN_MEMORY_MAX_BYTES = 16 * 1024 * 1024  # Larger files are parsed from disk
+TEXT_READ_SIZE = 64 * 1024  # Characters per read when streaming text files
+
+# Separates the pages of PDF text so chunks can be traced back to their page
+PAGE_BREAK = "\f"
+
+SOURCE_TYPES = (
+    ("pdf", (".pdf",)),
+    ("text", TEXT_EXTENSIONS),
+    ("code", CODE_EXTENSIONS),
+    ("config", CONFIG_EXTENSIONS),
+    ("web", WEB_EXTENSIONS),
+    ("table", TABLE_EXTENSIONS),
+    ("word", WORD_EXTENSIONS),
+    ("excel", EXCEL_EXTENSIONS),
+)
+
+
+class ExtractionError(Exception):
+    """A file could not be turned into text; the message is safe to show to users"""
+
+
+class ScannedPDFError(ExtractionError):
+    """The PDF has no text layer, raised instead of running OCR when `ocr=False`"""
+
+
+def is_buffer(source):
+    """Sources are file paths or, for uploads kept in memory, the file's bytes"""
+    return isinstance(source, (bytes, bytearray, memoryview))
+
+
+def open_pdf(source):
+    if is_buffer(source):
+        return fitz.open(stream=bytes(source), filetype="pdf")
+    return fitz.open(source)
+
+
+def decode_text(data):
+    try:
+        return bytes(data).decode("utf-8")
+    except UnicodeDecodeError:
+        return bytes(data).decode("latin-1")
+
+
+def iter_text_file(file_path, read_size=TEXT_READ_SIZE):
+    """Yield a text file in pieces of `read_size` characters.
+
+    The encoding is chosen from the first read: UTF-8 when it decodes, latin-1 otherwise.
+    """
+    with open(file_path, "rb") as f:
+        head = f.read(read_size)
+    try:
+        # A multi-byte character may be cut at the end of the sample
+        head.decode("utf-8")
+        encoding = "utf-8"
+    except UnicodeDecodeError as e:
+        encoding = "utf-8" if e.start >= len(head) - 3 and e.reason == "unexpected end of data" else "latin-1"
+    with open(file_path, "r", encoding=encoding, errors="replace") as f:
+        while True:
+            piece = f.read(read_size)
+            if not piece:
+                break
+            yield piece
+
+
+def read_text_file(file_path):
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            return f.read()
+    except UnicodeDecodeError:
+        with open(file_path, "r", encoding="latin-1") as f:
+            return f.read()
+
+
+def iter_pdf_pages(source):
+    """Yield the text of a PDF one page at a time, PAGE_BREAK-separated (empty pages included)"""
+    print(f"📄 Reading PDF: {f'{len(source)} bytes in memory' if is_buffer(source) else source}")
+    with open_pdf(source) as doc:
+        print(f"📄 PDF has {len(doc)} pages")
+        for page_num, page in enumerate(doc):
+            page_text = page.get_text() or ""
+            if page_text.strip():
+                print(f"   Page {page_num+1}: {len(page_text)} characters")
+            yield page_text if page_num == 0 else PAGE_BREAK + page_text
+
+
+def extract_pdf(source, ocr=True):
+    try:
+        # Empty pages are kept so page numbers stay right
+        text = "".join(iter_pdf_pages(source))
+        print(f"📄 Total text extracted: {len(text)} characters")
+    except Exception as e:
+        print(f"❌ PDF Error: {str(e)}")
+        print(f"❌ Error type: {type(e).__name__}")
+        traceback.print_exc()
+        raise ExtractionError(f"PDF processing failed: {str(e)}")
+
+    # If no text found, try OCR
+    if not text.strip():
+        if not ocr:
+            raise ScannedPDFError("PDF has no text layer")
+        text = ocr_pdf(source)
+    return text
+
+
+def ocr_dpi(page):
+    """Pick a DPI that renders the page's long edge at about OCR_TARGET_PIXELS"""
+    long_edge_inches = max(page.rect.width, page.rect.height) / 72.0
+    if long_edge_inches <= 0:
+        return OCR_MIN_DPI
+    return int(min(OCR_MAX_DPI, max(OCR_MIN_DPI, OCR_TARGET_PIXELS / long_edge_inches)))
+
+
+def init_worker():
+    """Initializer of the parse process pool"""
+    # One Tesseract thread per page, parallelism comes from the pool; OCR run without
+    # a pool (in the server process) keeps Tesseract's own threading
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+
+def ocr_pages(source, page_numbers, lang=OCR_LANGUAGES):
+    """OCR some pages of a PDF, returns (page_number, text) pairs; runs in a worker process"""
+    results = []
+    doc = open_pdf(source)
+    try:
+        for page_num in page_numbers:
+            page = doc[page_num]
+            # Render straight to 8-bit grayscale and hand the raw samples to Tesseract
+            pix = page.get_pixmap(dpi=ocr_dpi(page), colorspace=fitz.csGRAY, alpha=False)
+            image = Image.frombuffer("L", (pix.width, pix.height), pix.samples, "raw", "L", pix.stride, 1)
+            # pytesseract writes the image to a temp file in its format, PNG when it has none;
+            # uncompressed PGM saves the zlib pass on every page
+            image.format = "PPM"
+            results.append((page_num, pytesseract.image_to_string(image, lang=lang)))
+    finally:
+        doc.close()
+    return results
+
+
+def ocr_pdf(source, executor=None, progress=None):
+    """OCR every page of a scanned PDF.
+
+    With an `executor` (a process pool) pages are spread over its workers in
+    groups of OCR_PAGES_PER_TASK; `progress(pages_done, page_count)` is called
+    as groups finish. A PDF held in memory is written to a temporary file for
+    the workers rather than sent to every task.
+    """
+    if not OCR_AVAILABLE:
+        raise ExtractionError("PDF contains scanned images. OCR libraries not installed. Run: pip install pytesseract pillow")
+
+    print("📄 No text found, attempting OCR...")
+    temp_path = None
+    if executor is not None and is_buffer(source):
+        fd, temp_path = tempfile.mkstemp(suffix=".pdf")
+        with os.fdopen(fd, "wb") as f:
+            f.write(source)
+    file_path = temp_path or source
+    try:
+        with open_pdf(file_path) as doc:
+            page_count = len(doc)
+        groups = [list(range(start, min(start + OCR_PAGES_PER_TASK, page_count)))
+                  for start in range(0, page_count, OCR_PAGES_PER_TASK)]
+        page_texts = {}
+        if executor is None:
+            for group in groups:
+                page_texts.update(ocr_pages(file_path, group))
+                if progress:
+                    progress(len(page_texts), page_count)
+        else:
+            futures = [executor.submit(ocr_pages, file_path, group) for group in groups]
+            for future in as_completed(futures):
+                page_texts.update(future.result())
+                if progress:
+                    progress(len(page_texts), page_count)
+
+        ocr_text_parts = []
+        for page_num in range(page_count):
+            page_text = page_texts.get(page_num, "")
+            ocr_text_parts.append(page_text)
+            if page_text.strip():
+                print(f"   OCR Page {page_num+1}: {len(page_text)} characters")
+        text = PAGE_BREAK.join(ocr_text_parts)
+        print(f"📄 Total OCR text extracted: {len(text)} characters")
+    except Exception as ocr_error:
+        print(f"❌ OCR Error: {str(ocr_error)}")
+        traceback.print_exc()
+        raise ExtractionError(f"OCR failed: {str(ocr_error)}. Make sure Tesseract is installed: https://github.com/UB-Mannheim/tesseract/wiki")
+    finally:
+        if temp_path:
+            os.remove(temp_path)
+
+    if not text.strip():
+        raise ExtractionError("PDF appears to be empty even after OCR")
+    return text
+
+
+def extract_word(source):
+    if not DOCX_AVAILABLE:
+        raise ExtractionError("Word document support not installed. Run: pip install python-docx")
+    try:
+        doc = DocxDocument(io.BytesIO(source) if is_buffer(source) else source)
+        return "\n".join([paragraph.text for paragraph in doc.paragraphs])
+    except Exception as e:
+        raise ExtractionError(f"Word document processing failed: {str(e)}")
+
+
+def iter_excel_rows(source):
+    """Yield "Sheet: <title>" headers and tab-separated rows, streaming the workbook in read-only mode"""
+    wb = load_workbook(io.BytesIO(source) if is_buffer(source) else source, read_only=True, data_only=True)
+    try:
+        for sheet in wb.worksheets:
+            yield f"Sheet: {sheet.title}\n"
+            for row in sheet.iter_rows(values_only=True):
+                row_text = "\t".join([str(cell) if cell is not None else "" for cell in row])
+                if row_text.strip():
+                    yield row_text
+    finally:
+        wb.close()
+
+
+def extract_excel(source):
+    if not EXCEL_AVAILABLE:
+        raise ExtractionError("Excel support not installed. Run: pip install openpyxl")
+    try:
+        return "\n".join(iter_excel_rows(source))
+    except Exception as e:
+        raise ExtractionError(f"Excel processing failed: {str(e)}")
+
+
+def source_type(filename):
+    """Coarse file type recorded with every chunk: pdf, text, code, config, web, table, word, excel or other"""
+    file_lower = filename.lower()
+    for name, extensions in SOURCE_TYPES:
+        if file_lower.endswith(extensions):
+            return name
+    return "other"
+
+
+def extract_text(source, filename, ocr=True):
+    """Extract the text of a file (a path or the file's bytes), dispatching on the extension of `filename`.
+
+    With `ocr=False` scanned PDFs raise ScannedPDFError so the caller can run
+    `ocr_pdf` on a process pool instead.
+    """
+    file_lower = filename.lower()
+
+    if file_lower.endswith(".pdf"):
+        text = extract_pdf(source, ocr)
+    elif file_lower.endswith(TEXT_EXTENSIONS + CODE_EXTENSIONS + CONFIG_EXTENSIONS + WEB_EXTENSIONS + TABLE_EXTENSIONS):
+        text = decode_text(source) if is_buffer(source) else read_text_file(source)
+    elif file_lower.endswith(WORD_EXTENSIONS):
+        text = extract_word(source)
+    elif file_lower.endswith(EXCEL_EXTENSIONS):
+        text = extract_excel(source)
+    else:
+        # Try as text file
+        try:
+            if is_buffer(source):
+                text = bytes(source).decode("utf-8")
+            else:
+                with open(source, "r", encoding="utf-8") as f:
+                    text = f.read()
+        except Exception:
+            raise ExtractionError(f"Unsupported file type: {filename}")
+
+    if not text or len(text.strip()) == 0:
+        raise ExtractionError("File is empty or could not be read")
+    return text
+
+
+def extract_archive_member(archive_path, member, ocr=True):
+    """Extract the text of one file inside a zip archive; runs in a worker process.
+
+    Members up to IN_MEMORY_MAX_BYTES are parsed from memory, larger ones are
+    written to a temporary file, so archives are never unpacked as a whole.
+    """
+    with zipfile.ZipFile(archive_path) as archive:
+        if archive.getinfo(member).file_size <= IN_MEMORY_MAX_BYTES:
+            return extract_text(archive.read(member), member, ocr)
+        fd, temp_path = tempfile.mkstemp(suffix=os.path.splitext(member)[1])
+        try:
+            with os.fdopen(fd, "wb") as out, archive.open(member) as src:
+                shutil.copyfileobj(src, out)
+            return extract_text(temp_path, member, ocr)
+        finally:
+            os.remove(temp_path)
+
+
+def ocr_archive_member(archive_path, member, executor=None):
+    """`ocr_pdf` for a scanned PDF inside a zip archive, copied to a temporary file for the workers"""
+    fd, temp_path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as out, zipfile.ZipFile(archive_path) as archive, archive.open(member) as src:
+            shutil.copyfileobj(src, out)
+        return ocr_pdf(temp_path, executor)
+    finally:
+        os.remove(temp_path)
+
+
+def iter_text(file_path, filename):
+    """Streaming counterpart of `extract_text` for huge files: yields the text in pieces.
+
+    PDFs come page by page, text files in TEXT_READ_SIZE reads and workbooks row
+    by row, so memory does not grow with the file. Scanned PDFs raise
+    ScannedPDFError once all pages turn out to be empty (OCR output is small
+    enough for `ocr_pdf`).
+    """
+    file_lower = filename.lower()
+    if file_lower.endswith(".pdf"):
+        pieces = iter_pdf_pages(file_path)
+    elif file_lower.endswith(WORD_EXTENSIONS):
+        if not DOCX_AVAILABLE:
+            raise ExtractionError("Word document support not installed. Run: pip install python-docx")
+        pieces = (paragraph.text + "\n" for paragraph in DocxDocument(file_path).paragraphs)
+    elif file_lower.endswith(EXCEL_EXTENSIONS):
+        if not EXCEL_AVAILABLE:
+            raise ExtractionError("Excel support not installed. Run: pip install openpyxl")
+        pieces = (row + "\n" for row in iter_excel_rows(file_path))
+    else:
+        pieces = iter_text_file(file_path)
+
+    has_text = False
+    try:
+        for piece in pieces:
+            has_text = has_text or bool(piece.strip())
+            yield piece
+    except ExtractionError:
+        raise
+    except Exception as e:
+        raise ExtractionError(f"Processing {filename} failed: {str(e)}")
+    if not has_text:
+        if file_lower.endswith(".pdf"):
+            raise ScannedPDFError("PDF has no text layer")
+        raise ExtractionError("File is empty or could not be read")
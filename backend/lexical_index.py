@@ -0,0 +1,144 @@
+"""In-process BM25 keyword index used next to the vector indexes.
+
+Tokens keep identifiers intact ("ERR_CONN_RESET", "getUserById",
+"0x80004005") so exact names and error codes pasted into a query match the
+chunks that contain them; the parts of snake_case and dotted names are
+indexed too.
+"""
+import heapq
+import math
+import pickle
+import re
+import threading
+from collections import Counter
+
+TOKEN_RE = re.compile(r"\w+(?:[.:\-]\w+)*")
+IDENTIFIER_RE = re.compile(r"[_\d.:\-]|[a-z][A-Z]|^[A-Z]{2,}$")
+
+
+def tokenize(text):
+    """Lowercased tokens of `text`: whole identifiers plus the parts of compound ones"""
+    tokens = []
+    for match in TOKEN_RE.findall(text):
+        token = match.lower()
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in re.split(r"[_.:\-]+", token) if part)
+    return tokens
+
+
+def is_keyword_query(query, max_terms=3):
+    """True for short queries made of identifiers/codes, where BM25 alone is reliable"""
+    words = query.split()
+    if not words or len(words) > max_terms or "?" in query:
+        return False
+    return all(IDENTIFIER_RE.search(word.strip("\"'`()[],;")) for word in words)
+
+
+class BM25Index:
+    """Okapi BM25 over an inverted index (term -> {doc id: term frequency}).
+
+    Documents can be added and removed one by one, so the index is kept up to
+    date as chunks are inserted and deleted instead of being rebuilt.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self.postings = {}
+        self.doc_lengths = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, ids, texts):
+        with self._lock:
+            self._discard([doc_id for doc_id in ids if doc_id in self.doc_lengths])
+            for doc_id, text in zip(ids, texts):
+                counts = Counter(tokenize(text))
+                for term, tf in counts.items():
+                    self.postings.setdefault(term, {})[doc_id] = tf
+                length = sum(counts.values())
+                self.doc_lengths[doc_id] = length
+                self.total_length += length
+
+    def _discard(self, ids, texts=None):
+        if not ids:
+            return
+        for doc_id in ids:
+            self.total_length -= self.doc_lengths.pop(doc_id)
+        # Without the texts every posting list has to be checked
+        terms = {term for text in texts for term in tokenize(text)} if texts is not None else list(self.postings)
+        for term in terms:
+            docs = self.postings.get(term)
+            if docs is None:
+                continue
+            for doc_id in ids:
+                docs.pop(doc_id, None)
+            if not docs:
+                del self.postings[term]
+
+    def remove(self, ids, texts=None):
+        """Remove documents by id; passing their texts avoids scanning every posting list"""
+        with self._lock:
+            if texts is None:
+                self._discard([doc_id for doc_id in ids if doc_id in self.doc_lengths])
+            else:
+                known = [(doc_id, text) for doc_id, text in zip(ids, texts) if doc_id in self.doc_lengths]
+                self._discard([doc_id for doc_id, _ in known], [text for _, text in known])
+
+    def clear(self):
+        with self._lock:
+            self.postings = {}
+            self.doc_lengths = {}
+            self.total_length = 0
+
+    def search(self, query, k=5, ids=None):
+        """Return up to `k` (score, id) pairs ordered by descending BM25 score, only among `ids` if given"""
+        with self._lock:
+            n = len(self.doc_lengths)
+            if n == 0:
+                return []
+            avg_length = self.total_length / n
+            scores = {}
+            for term in set(tokenize(query)):
+                docs = self.postings.get(term)
+                if not docs:
+                    continue
+                idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+                for doc_id, tf in docs.items():
+                    if ids is not None and doc_id not in ids:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(score, doc_id) for doc_id, score in best]
+
+    def save(self, path, stamp=None):
+        with self._lock:
+            with open(path, "wb") as f:
+                pickle.dump({"stamp": stamp, "postings": self.postings, "doc_lengths": self.doc_lengths,
+                             "k1": self.k1, "b": self.b}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        """Returns (index, stamp) from a file written by `save`"""
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        index = cls(data["k1"], data["b"])
+        index.postings = data["postings"]
+        index.doc_lengths = data["doc_lengths"]
+        index.total_length = sum(index.doc_lengths.values())
+        return index, data["stamp"]
+
+
+def reciprocal_rank_fusion(rankings, k=60, limit=None):
+    """Fuse ranked lists of keys: score = sum of 1 / (k + rank) over the lists a key appears in"""
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    fused = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    return fused[:limit] if limit is not None else fused
@@ -1,7 +1,12 @@
 import sys
 import os
 import traceback
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
+
+if __name__ == "__main__":
+    # Must run first: in the packaged app, parse worker processes re-launch this executable
+    import multiprocessing
+    multiprocessing.freeze_support()
 
 # Setup logging to file immediately to catch import errors
 app_data_dir = os.path.join(os.getenv('APPDATA'), 'RAGulea')
@@ -16,47 +21,42 @@ def log_error(msg):
         pass
 
 try:
-    from fastapi import FastAPI, UploadFile, File, HTTPException, Body
+    from fastapi import FastAPI, UploadFile, File, HTTPException, Body, Request
     from fastapi.middleware.cors import CORSMiddleware
     from fastapi.staticfiles import StaticFiles
     from pydantic import BaseModel
     from typing import List, Optional
+    import bisect
+    import hashlib
+    import heapq
+    import json
+    import re
+    import unicodedata
+    from datetime import datetime, timezone
     import shutil
+    import tempfile
+    import threading
+    import time
     import uvicorn
+    import zipfile
+    from collections import OrderedDict, deque
+    from itertools import islice
+    from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
     import socket
-    from pymongo import MongoClient
+    from pymongo import MongoClient, ReturnDocument, UpdateOne
     from langchain_text_splitters import RecursiveCharacterTextSplitter
-    from langchain_ollama import OllamaEmbeddings, OllamaLLM
     import numpy as np
+    from bson.binary import Binary
     from bson.objectid import ObjectId
-    import fitz  # PyMuPDF
-    try:
-        from docx import Document as DocxDocument
-        DOCX_AVAILABLE = True
-    except ImportError:
-        DOCX_AVAILABLE = False
-    try:
-        from openpyxl import load_workbook
-        EXCEL_AVAILABLE = True
-    except ImportError:
-        EXCEL_AVAILABLE = False
-    try:
-        import pytesseract
-        from pdf2image import convert_from_path
-        from PIL import Image
-        # Set Tesseract path for Windows
-        if os.name == 'nt':
-            tesseract_paths = [
-                r"C:\Program Files\Tesseract-OCR\tesseract.exe",
-                r"C:\Program Files (x86)\Tesseract-OCR\tesseract.exe"
-            ]
-            for path in tesseract_paths:
-                if os.path.exists(path):
-                    pytesseract.pytesseract.tesseract_cmd = path
-                    break
-        OCR_AVAILABLE = True
-    except ImportError:
-        OCR_AVAILABLE = False
+    import uuid
+    from fastapi.concurrency import run_in_threadpool
+    from extractors import (IN_MEMORY_MAX_BYTES, PAGE_BREAK, ExtractionError, ScannedPDFError, extract_archive_member,
+                            extract_text, init_worker, iter_text, ocr_archive_member, ocr_pdf, source_type)
+    from vector_index import FlatIndex, IVFIndex, VectorSegment
+    from lexical_index import BM25Index, is_keyword_query, reciprocal_rank_fusion
+    from ollama_clients import OllamaClients
+    from context_builder import build_context
+    from micro_batching import MicroBatcher
 except Exception:
     log_error("IMPORT ERROR:")
     log_error(traceback.format_exc())
@@ -95,9 +95,14 @@ def get_all_collection_names():
     """Get all collection names from MongoDB"""
     return [name for name in db.list_collection_names() if name.startswith('documents_')]
 
+# The collection registry is re-read from MongoDB at most this often (collections created by
+# another process, e.g. the ingest CLI); create/delete in this process update it directly
+COLLECTION_REGISTRY_TTL = 60  # Seconds
+collections_loaded_at = 0.0
+
 def load_all_collections():
     """Load all collections including custom ones"""
-    global collections
+    global collections, collections_loaded_at
     all_coll_names = get_all_collection_names()
     collections = {}
     
@@ -113,6 +118,16 @@ def load_all_collections():
             if custom_name not in collections:
                 collections[custom_name] = db[coll_name]
     
+    collections_loaded_at = time.monotonic()
+    return collections
+
+def refresh_collection_registry(force: bool = False):
+    """Reload the registry when it is older than COLLECTION_REGISTRY_TTL (or `force`)"""
+    if force or time.monotonic() - collections_loaded_at > COLLECTION_REGISTRY_TTL:
+        load_all_collections()
+        for coll in list(collections.values()):
+            # Collections created outside this process get their indexes here
+            ensure_collection_indexes(coll)
     return collections
 
 # Load all collections on startup
@@ -132,20 +147,496 @@ def get_collection_for_file(filename: str):
     else:
         return collections["other"]
 
-# Ollama Setup
-OLLAMA_BASE_URL = "http://localhost:11434"
+# Serves distinct/scans by embedding model (prefix), per-file lookups and their fingerprint projection
+CHUNK_INDEX = [("embedding_model", 1), ("filename", 1), ("fingerprint", 1)]
+# Metadata filters of chat requests (see SearchFilters)
+METADATA_INDEXES = [
+    [("embedding_model", 1), ("uploaded_at", 1)],
+    [("embedding_model", 1), ("source_type", 1)],
+    [("embedding_model", 1), ("tags", 1)]
+]
+# The single-field index released versions created, now a prefix of CHUNK_INDEX
+SUPERSEDED_INDEXES = ("embedding_model_1",)
+indexed_collections = set()
+
+def ensure_collection_indexes(coll):
+    """Create the indexes the upload and retrieval paths rely on (no-op if they exist)"""
+    if coll.name in indexed_collections:
+        return
+    coll.create_index(CHUNK_INDEX)
+    for keys in METADATA_INDEXES:
+        coll.create_index(keys)
+    existing = coll.index_information()
+    for name in SUPERSEDED_INDEXES:
+        if name in existing:
+            coll.drop_index(name)
+    indexed_collections.add(coll.name)
+
+@app.on_event("startup")
+def create_collection_indexes():
+    try:
+        load_all_collections()
+        for coll in list(collections.values()):
+            ensure_collection_indexes(coll)
+    except Exception as e:
+        print(f"⚠️  Could not create collection indexes: {str(e)}")
+
+# Ollama Setup (override with OLLAMA_BASE_URL, e.g. to point at mock_ollama.py in tests)
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+OLLAMA_CONNECT_TIMEOUT = 5.0  # Seconds
+OLLAMA_READ_TIMEOUT = 300.0  # Seconds without a byte from Ollama, covers loading a model
+OLLAMA_RETRIES = 2  # Retries of failed connections and busy (429/5xx) answers, with exponential backoff
+OLLAMA_RETRY_BACKOFF = 0.5  # Seconds before the first retry
+OLLAMA_MAX_CONCURRENCY = 4  # Concurrent calls per model
+OLLAMA_MODEL_CONCURRENCY = {}  # Per-model overrides, e.g. {"llama3.1:70b": 1}
+
+# One pooled client per model, shared by all requests
+ollama_clients = OllamaClients(OLLAMA_BASE_URL, OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT, OLLAMA_RETRIES,
+                               OLLAMA_RETRY_BACKOFF, OLLAMA_MAX_CONCURRENCY, OLLAMA_MODEL_CONCURRENCY)
+
+@app.on_event("shutdown")
+def close_ollama_clients():
+    ollama_clients.close()
+
+# Ingestion pipeline settings
+EMBED_BATCH_SIZE = 32  # Chunks sent to Ollama per embed_documents call
+EMBED_MAX_IN_FLIGHT = 4  # Concurrent embedding requests per upload
+INSERT_BATCH_SIZE = 500  # Documents per insert_many
 
 # Ensure upload directory exists in user's AppData to avoid permission issues
 UPLOAD_DIR = os.path.join(os.getenv('APPDATA'), 'RAGulea', 'uploads')
 os.makedirs(UPLOAD_DIR, exist_ok=True)
+# Large uploads are spooled here while their job runs; emptied at startup
+UPLOAD_TMP_DIR = os.path.join(UPLOAD_DIR, 'tmp')
+os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+
+# POST /api/ingest/bulk only reads directories and archives placed under this folder
+# (None = the endpoint is disabled); the CLI (python main.py ingest <path>) reads any path
+BULK_INGEST_ROOT = os.path.join(os.getenv('APPDATA'), 'RAGulea', 'ingest')
+if BULK_INGEST_ROOT:
+    os.makedirs(BULK_INGEST_ROOT, exist_ok=True)
+
+
+
+# Vector search settings
+# "ivf" = approximate search once a collection is large enough, "flat" = always exact
+VECTOR_INDEX_TYPE = "ivf"
+# ANN_NPROBE trades recall for latency: more probed lists = better recall, slower queries
+ANN_NPROBE = 32
+ANN_NLIST = None  # None = auto (4 * sqrt(number of vectors))
+ANN_MIN_TRAIN_SIZE = 4096  # Below this many vectors an index is searched exhaustively
+ANN_BUILD_BATCH_SIZE = 10000
+# Optional compressed first pass per collection: None, "int8" (4x smaller) or "pq" (product quantization)
+VECTOR_QUANTIZATION_DEFAULT = None
+VECTOR_RERANK_FACTOR = 16  # Quantized candidates re-ranked exactly = k * this
+PQ_SUBSPACES = None  # Bytes per vector with "pq", None = dimensions / 4
+# Modes PUT /api/collections/{name}/quantization accepts. They trade latency (and with PQ recall)
+# for memory, see `python benchmark.py quantization`; on 100k x 1024-d vectors:
+#   exact float32: 390.6 MB scanned, 27 ms
+#   int8: 97.7 MB of codes, recall@10 1.000, 53-61 ms
+#   pq: 24.4 MB of codes, recall@10 0.49 (re-ranking k x 4) to 0.82 (k x 16), 85-90 ms
+# The first pass only reads the codes, so the OS can page out the vectors of a large collection
+OFFERED_QUANTIZATIONS = ("int8", "pq")
+
+# Vectors live in on-disk segments, one per (collection, embedding model): append-only float32
+# files that are memory-mapped, so a restart does not re-read any vectors. MongoDB still keeps a
+# packed copy of every embedding, which a missing or stale segment is rebuilt from.
+# None = no segments, indexes are built from the MongoDB embeddings on every start
+VECTOR_SEGMENT_DIR = os.path.join(app_data_dir, "vectors")
+
+# Per-collection settings (currently the quantization mode), persisted in MongoDB
+collection_settings_coll = db["collection_settings"]
+collection_settings = {}
+
+def load_collection_settings():
+    collection_settings.clear()
+    for doc in collection_settings_coll.find({}):
+        collection_settings[doc["_id"]] = doc
+
+def get_collection_quantization(coll_name: str):
+    return collection_settings.get(coll_name, {}).get("quantization", VECTOR_QUANTIZATION_DEFAULT)
+
+# How embeddings are written to MongoDB: "float32"/"float16" = packed BSON Binary, "list" = array of doubles
+EMBEDDING_STORAGE_DTYPE = "float32"
+# User-defined BSON Binary subtypes tagging the packed dtype
+EMBEDDING_BINARY_SUBTYPES = {"float32": 0x80, "float16": 0x81}
+EMBEDDING_BINARY_DTYPES = {subtype: np.dtype(name).newbyteorder("<") for name, subtype in EMBEDDING_BINARY_SUBTYPES.items()}
+
+def encode_embedding(vector, dtype: str = None):
+    """Convert an embedding to its MongoDB representation"""
+    dtype = dtype or EMBEDDING_STORAGE_DTYPE
+    if dtype == "list":
+        return [float(x) for x in vector]
+    packed = np.asarray(vector, dtype=np.dtype(dtype).newbyteorder("<")).tobytes()
+    return Binary(packed, EMBEDDING_BINARY_SUBTYPES[dtype])
+
+def decode_embedding(value):
+    """Stored embedding (packed Binary or legacy list) -> NumPy vector, without copying packed data"""
+    if isinstance(value, Binary) and value.subtype in EMBEDDING_BINARY_DTYPES:
+        return np.frombuffer(value, dtype=EMBEDDING_BINARY_DTYPES[value.subtype])
+    return np.asarray(value, dtype=np.float32)
+
+def embedding_encoding(value):
+    if isinstance(value, Binary):
+        return {subtype: name for name, subtype in EMBEDDING_BINARY_SUBTYPES.items()}.get(value.subtype)
+    return "list"
+
+# One vector index per (MongoDB collection name, embedding model)
+vector_indexes = {}
+# Change counter value (see collection_version) each loaded vector index reflects, like
+# lexical_index_versions; saved with the segment at shutdown so the next start can trust it
+vector_index_versions = {}
+# Builds in progress: key -> {"future" of the index, "dropped"}; built by the first caller outside
+# vector_index_lock, so only requests for that collection wait meanwhile
+vector_index_builds = {}
+vector_index_lock = threading.RLock()
+
+def new_vector_index(coll_name: str):
+    options = {
+        "quantization": get_collection_quantization(coll_name),
+        "rerank_factor": VECTOR_RERANK_FACTOR,
+        "pq_subspaces": PQ_SUBSPACES
+    }
+    if VECTOR_INDEX_TYPE == "flat":
+        return FlatIndex, options
+    return IVFIndex, {**options, "nlist": ANN_NLIST, "nprobe": ANN_NPROBE, "min_train_size": ANN_MIN_TRAIN_SIZE}
+
+def vector_segment_path(coll_name: str, embedding_model: str):
+    model_hash = hashlib.sha1(embedding_model.encode("utf-8")).hexdigest()[:8]
+    safe_model = re.sub(r"[^A-Za-z0-9_.-]", "_", embedding_model)
+    return os.path.join(VECTOR_SEGMENT_DIR, coll_name, f"{safe_model}-{model_hash}")
+
+def decode_segment_id(raw: bytes):
+    return ObjectId(raw.decode("ascii"))
+
+def stored_embedding_batches(coll, embedding_model: str):
+    """Yield (ids, float32 matrix) batches of the embeddings stored in MongoDB documents"""
+    ids, batch = [], []
+    cursor = coll.find(
+        {"embedding_model": embedding_model, "embedding": {"$exists": True}},
+        {"embedding": 1}
+    ).batch_size(ANN_BUILD_BATCH_SIZE)
+    for doc in cursor:
+        ids.append(doc["_id"])
+        batch.append(decode_embedding(doc["embedding"]))
+        if len(batch) >= ANN_BUILD_BATCH_SIZE:
+            # Convert per batch so we never hold the whole corpus as Python objects
+            yield ids, np.stack(batch).astype(np.float32, copy=False)
+            ids, batch = [], []
+    if batch:
+        yield ids, np.stack(batch).astype(np.float32, copy=False)
+
+def build_vector_index(coll, embedding_model: str, version: int):
+    """Open the on-disk segment of a collection, or load its embeddings from MongoDB and index them.
+
+    MongoDB keeps the packed embedding of every chunk, so a segment is only a fast-loading copy.
+    One saved at `version` of the collection (see collection_version) is used as is; otherwise
+    its row count is checked against MongoDB and it is (re)built from the documents if they differ.
+    """
+    index_class, options = new_vector_index(coll.name)
+    if VECTOR_SEGMENT_DIR:
+        segment = VectorSegment(vector_segment_path(coll.name, embedding_model), decode_id=decode_segment_id)
+        if segment.exists:
+            index = index_class.open(segment, **options)
+            if segment.stamp == version:
+                return index
+            # Not shut down cleanly or the collection changed since: only now count the chunks
+            stored = coll.count_documents({"embedding_model": embedding_model, "embedding": {"$exists": True}})
+            if len(index) == stored:
+                index.save(stamp=version)
+                return index
+            # Written by another process, restored from a backup or left behind by a crash
+            print(f"⚠️  Segment of {coll.name} [{embedding_model}] has {len(index)} vectors, MongoDB {stored}: rebuilding")
+            index.clear()
+        else:
+            index = index_class(segment=segment, **options)
+        for ids, matrix in stored_embedding_batches(coll, embedding_model):
+            index.add(ids, matrix)
+        index.save(stamp=version)
+        if not segment.exists:
+            # Nothing stored yet, record the empty segment
+            segment.commit(0, stamp=version)
+        if len(index):
+            print(f"💾 Wrote {len(index)} embeddings of {coll.name} [{embedding_model}] to {segment.path}")
+        return index
+    blocks = list(stored_embedding_batches(coll, embedding_model))
+    if not blocks:
+        return index_class(**options)
+    ids = [doc_id for block_ids, _ in blocks for doc_id in block_ids]
+    return index_class.from_matrix(ids, np.concatenate([matrix for _, matrix in blocks]), **options)
+
+def get_vector_index(coll, embedding_model: str):
+    """Return the ANN index for a collection, building it on first use.
+
+    The first caller builds it without holding vector_index_lock; other callers for the same
+    collection wait for that build, those of other collections are not blocked.
+    """
+    key = (coll.name, embedding_model)
+    with vector_index_lock:
+        index = vector_indexes.get(key)
+        if index is not None:
+            return index
+        build = vector_index_builds.get(key)
+        if build is not None:
+            future = build["future"]
+        else:
+            build = vector_index_builds[key] = {"future": Future(), "dropped": False}
+            future = None
+    if future is not None:
+        return future.result()
+    try:
+        version = collection_version(coll.name)
+        index = build_vector_index(coll, embedding_model, version)
+    except BaseException as e:
+        with vector_index_lock:
+            del vector_index_builds[key]
+        build["future"].set_exception(e)
+        raise
+    with vector_index_lock:
+        del vector_index_builds[key]
+        if not build["dropped"]:
+            vector_indexes[key] = index
+            vector_index_versions[key] = version if collection_version(coll.name) == version else None
+    build["future"].set_result(index)
+    print(f"🧭 Built vector index {coll.name} [{embedding_model}]: {len(index)} vectors")
+    return index
+
+def loaded_vector_index(coll, embedding_model: str):
+    """The index to keep in sync with inserts/deletes; None if it can simply be rebuilt from MongoDB later"""
+    key = (coll.name, embedding_model)
+    with vector_index_lock:
+        index = vector_indexes.get(key)
+        if index is not None or not (VECTOR_SEGMENT_DIR or key in vector_index_builds):
+            return index
+    # Keep the segment in step with MongoDB, otherwise it is rebuilt on next use. A build in
+    # progress may have read MongoDB before this change, so wait for it and apply the change too
+    return get_vector_index(coll, embedding_model)
+
+def add_to_vector_index(coll, embedding_model: str, ids, vectors):
+    """Keep the index (and its segment) in sync with newly inserted chunks"""
+    index = loaded_vector_index(coll, embedding_model)
+    if index is not None:
+        index.add(ids, vectors)
 
+def remove_from_vector_index(coll, embedding_model: str, ids):
+    index = loaded_vector_index(coll, embedding_model)
+    if index is not None:
+        index.remove(ids)
 
+def drop_vector_indexes(coll_name: str, delete_segments: bool = False):
+    """Forget every vector index of a collection; with `delete_segments` (the documents were deleted)
+    also drop its keyword indexes and empty and remove its on-disk segments"""
+    with vector_index_lock:
+        for key in [key for key in vector_indexes if key[0] == coll_name]:
+            if delete_segments:
+                # Releases the memory maps so the files can be removed
+                vector_indexes[key].clear()
+            del vector_indexes[key]
+            vector_index_versions.pop(key, None)
+        for key, build in vector_index_builds.items():
+            if key[0] == coll_name:
+                # Its callers still get the index, the next one builds a fresh one
+                build["dropped"] = True
+        if delete_segments:
+            for key in [key for key in lexical_indexes if key[0] == coll_name]:
+                del lexical_indexes[key]
+                lexical_index_versions.pop(key, None)
+            for key in [key for key in lexical_builds if key[0] == coll_name]:
+                del lexical_builds[key]
+        if delete_segments and VECTOR_SEGMENT_DIR:
+            shutil.rmtree(os.path.join(VECTOR_SEGMENT_DIR, coll_name), ignore_errors=True)
+
+def build_all_vector_indexes():
+    """Build indexes for every collection and embedding model found in MongoDB"""
+    for coll in list(collections.values()):
+        for embedding_model in coll.distinct("embedding_model"):
+            get_vector_index(coll, embedding_model)
+
+# Hybrid retrieval: a BM25 keyword index per (collection, embedding model) next to the vector
+# index, fused with the vector results by reciprocal rank. "vector", "lexical" or "hybrid"
+RETRIEVAL_MODE = "hybrid"
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid")
+RRF_K = 60
+HYBRID_CANDIDATES = 20  # Hits taken from each retriever before fusion
+# Short queries made only of identifiers/error codes skip the query embedding
+LEXICAL_FAST_PATH = True
+LEXICAL_FAST_PATH_MAX_TERMS = 3
+
+lexical_indexes = {}
+# Change counter value (see collection_version) each loaded keyword index reflects;
+# None once the collection changed in a way this process did not see
+lexical_index_versions = {}
+# Builds in progress: key -> {"future", "journal" of the adds/removes made meanwhile, "bumps"}
+lexical_builds = {}
+# Indexes are built on first use in the background, one at a time; searches use vectors only until then
+lexical_build_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bm25")
+
+def lexical_index_path(coll_name: str, embedding_model: str):
+    """Where the keyword index is saved (None = always rebuilt from MongoDB)"""
+    if not VECTOR_SEGMENT_DIR:
+        return None
+    return vector_segment_path(coll_name, embedding_model) + ".bm25.pkl"
+
+def build_lexical_index(coll, embedding_model: str, version: int):
+    """Load the saved keyword index if it was saved at `version` of the collection, or index the
+    chunk texts stored in MongoDB; returns (index, loaded from the snapshot)"""
+    path = lexical_index_path(coll.name, embedding_model)
+    if path and os.path.exists(path):
+        try:
+            index, stamp = BM25Index.load(path)
+            if stamp == version:
+                return index, True
+        except Exception as e:
+            print(f"⚠️  Could not load keyword index {path}: {str(e)}")
+    index = BM25Index()
+    ids, texts = [], []
+    for doc in coll.find({"embedding_model": embedding_model}, {"content": 1}).batch_size(ANN_BUILD_BATCH_SIZE):
+        ids.append(doc["_id"])
+        texts.append(doc.get("content", ""))
+        if len(ids) >= ANN_BUILD_BATCH_SIZE:
+            index.add(ids, texts)
+            ids, texts = [], []
+    index.add(ids, texts)
+    return index, False
+
+def load_lexical_index(coll, embedding_model: str, build):
+    key = (coll.name, embedding_model)
+    version = collection_version(coll.name)
+    try:
+        index, from_snapshot = build_lexical_index(coll, embedding_model, version)
+    except Exception:
+        with vector_index_lock:
+            # The next search starts a new build
+            if lexical_builds.get(key) is build:
+                del lexical_builds[key]
+        raise
+    path = lexical_index_path(coll.name, embedding_model)
+    if not from_snapshot and path and os.path.isdir(os.path.dirname(path)) and collection_version(coll.name) == version:
+        # Saved right away, so a crash before shutdown does not mean another full rebuild
+        index.save(path, stamp=version)
+    with vector_index_lock:
+        if lexical_builds.get(key) is not build:
+            # The collection was cleared or deleted meanwhile
+            return index
+        for op, ids, texts in build["journal"]:
+            if op == "add":
+                index.add(ids, texts)
+            else:
+                index.remove(ids, texts)
+        current = collection_version(coll.name)
+        lexical_index_versions[key] = current if current == version + build["bumps"] else None
+        lexical_indexes[key] = index
+        del lexical_builds[key]
+    print(f"🔤 {'Loaded' if from_snapshot else 'Built'} keyword index {coll.name} [{embedding_model}]: {len(index)} chunks")
+    return index
+
+def get_lexical_index(coll, embedding_model: str, wait: bool = True):
+    """Return the keyword index for a collection, building it on first use.
+
+    With `wait=False` None is returned while the index is still being built.
+    """
+    key = (coll.name, embedding_model)
+    with vector_index_lock:
+        index = lexical_indexes.get(key)
+        if index is not None:
+            return index
+        build = lexical_builds.get(key)
+        if build is None:
+            build = lexical_builds[key] = {"journal": [], "bumps": 0}
+            build["future"] = lexical_build_executor.submit(load_lexical_index, coll, embedding_model, build)
+    return build["future"].result() if wait else None
+
+def add_to_lexical_index(coll, embedding_model: str, ids, texts):
+    # MongoDB has the texts, so an index that isn't loaded is simply built later
+    with vector_index_lock:
+        key = (coll.name, embedding_model)
+        index = lexical_indexes.get(key)
+        if index is None and key in lexical_builds:
+            lexical_builds[key]["journal"].append(("add", ids, texts))
+    if index is not None:
+        index.add(ids, texts)
+
+def remove_from_lexical_index(coll, embedding_model: str, ids):
+    """Must run before the chunks are deleted from MongoDB: their texts locate the postings to drop"""
+    key = (coll.name, embedding_model)
+    with vector_index_lock:
+        if key not in lexical_indexes and key not in lexical_builds:
+            return
+    docs = {doc["_id"]: doc.get("content", "") for doc in coll.find({"_id": {"$in": ids}}, {"content": 1})}
+    with vector_index_lock:
+        index = lexical_indexes.get(key)
+        if index is None and key in lexical_builds:
+            lexical_builds[key]["journal"].append(("remove", list(docs), list(docs.values())))
+    if index is not None:
+        index.remove(list(docs), list(docs.values()))
+
+def collection_version(coll_name: str):
+    """Change counter of a collection, bumped in MongoDB on every insert/delete (by the server and the CLI)"""
+    doc = collection_settings_coll.find_one({"_id": coll_name}, {"changes": 1})
+    return (doc or {}).get("changes", 0)
+
+def bump_collection_version(coll_name: str):
+    version = collection_settings_coll.find_one_and_update(
+        {"_id": coll_name}, {"$inc": {"changes": 1}}, projection={"changes": 1},
+        upsert=True, return_document=ReturnDocument.AFTER)["changes"]
+    with vector_index_lock:
+        for versions in (vector_index_versions, lexical_index_versions):
+            for key in versions:
+                if key[0] == coll_name:
+                    # Our own change if the counter moved by one, otherwise another process changed it too
+                    previous = versions[key]
+                    versions[key] = version if previous == version - 1 else None
+        for key, build in lexical_builds.items():
+            if key[0] == coll_name:
+                build["bumps"] += 1
+    return version
+
+@app.on_event("shutdown")
+def save_vector_indexes():
+    """Persist trained index state so the next start only has to catch up on new rows"""
+    with vector_index_lock:
+        for key, index in vector_indexes.items():
+            # Without a version the next start counts the chunks in MongoDB to validate the segment
+            index.save(stamp=vector_index_versions.get(key))
+        for (coll_name, embedding_model), index in lexical_indexes.items():
+            path = lexical_index_path(coll_name, embedding_model)
+            version = lexical_index_versions.get((coll_name, embedding_model))
+            if path and version is not None and os.path.isdir(os.path.dirname(path)):
+                index.save(path, stamp=version)
+
+@app.on_event("startup")
+def load_vector_indexes():
+    try:
+        load_collection_settings()
+        build_all_vector_indexes()
+    except Exception as e:
+        # Indexes are also built lazily on first query, so startup can continue
+        print(f"⚠️  Could not build vector indexes at startup: {str(e)}")
+        log_error(f"Vector index build error: {str(e)}")
+        log_error(traceback.format_exc())
+
+class SearchFilters(BaseModel):
+    """Chunk metadata filters, applied through MongoDB indexes before any similarity scoring"""
+    filenames: Optional[List[str]] = None
+    source_types: Optional[List[str]] = None  # pdf, text, code, config, web, table, word, excel, other
+    tags: Optional[List[str]] = None  # Chunks with any of these tags
+    uploaded_after: Optional[datetime] = None
+    uploaded_before: Optional[datetime] = None
+    pages: Optional[List[int]] = None  # [first, last] page, inclusive (PDFs)
 
 class QueryRequest(BaseModel):
     query: str
     model: str
     embedding_model: Optional[str] = "mxbai-embed-large:latest"
     collection_filter: Optional[List[str]] = None  # Filter by collection types
+    nprobe: Optional[int] = None  # ANN lists to probe, overrides ANN_NPROBE
+    exact: Optional[bool] = False  # Skip ANN and score every stored vector
+    debug: Optional[bool] = False  # Include per-collection search timings in the response
+    retrieval: Optional[str] = None  # "vector", "lexical" or "hybrid", overrides RETRIEVAL_MODE
+    filters: Optional[SearchFilters] = None
+    top_k: Optional[int] = None  # k: chunks given to the LLM, default SEARCH_TOP_K
+    candidates: Optional[int] = None  # N: candidates retrieved for the re-ranker, default RERANK_CANDIDATES
+    reranker: Optional[str] = None  # "none", "lexical", "embedding" or "llm", overrides RERANKER
 
 class ModelListResponse(BaseModel):
     models: List[str]
@@ -161,16 +652,329 @@ class CollectionStats(BaseModel):
 class CreateCollectionRequest(BaseModel):
     name: str
 
+class QuantizationRequest(BaseModel):
+    quantization: Optional[str] = None  # None or one of OFFERED_QUANTIZATIONS
+
+class BulkIngestRequest(BaseModel):
+    path: str  # Directory or .zip archive under BULK_INGEST_ROOT (relative paths are resolved against it)
+    embedding_model: Optional[str] = "mxbai-embed-large:latest"
+    target_collection: Optional[str] = None  # None = auto-detect per file
+    tags: Optional[List[str]] = None
+    resume: Optional[bool] = True  # Skip files finished by an earlier run of the same path
+
+# Response cache settings
+RESPONSE_CACHE_MAX_ENTRIES = 512
+RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+RESPONSE_CACHE_TTL_SECONDS = 3600
+RESPONSE_CACHE_SIMILARITY = 0.97  # Cosine similarity above which a cached answer is reused
+
+class ResponseCache:
+    """Two-level cache of chat answers.
+
+    The exact tier is keyed by the full request; the semantic tier reuses an
+    answer for a request with the same settings whose query embedding is
+    within RESPONSE_CACHE_SIMILARITY of a cached one. Entries expire after a
+    TTL, are evicted least-recently-used past the entry/memory caps and are
+    dropped when any collection they were answered from changes.
+    """
+
+    def __init__(self, max_entries, max_bytes, ttl_seconds, similarity):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.similarity = similarity
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.collection_versions = {}
+        self.bytes = 0
+        self.counters = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    @staticmethod
+    def keys(request: QueryRequest):
+        """(exact key, semantic scope) for a request; the scope is every setting except the query"""
+        settings = request.model_dump(exclude={"query", "debug"})
+        if settings.get("collection_filter"):
+            settings["collection_filter"] = sorted(settings["collection_filter"])
+        scope = json.dumps(settings, sort_keys=True, default=str)
+        return (request.query, scope), scope
+
+    def versions(self):
+        with self.lock:
+            return dict(self.collection_versions)
+
+    def _expired(self, entry):
+        return time.time() - entry["created_at"] > self.ttl_seconds
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.bytes -= entry["size"]
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self._expired(entry):
+                self._remove(key)
+                entry = None
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            self.counters["exact_hits"] += 1
+            return entry
+
+    def get_similar(self, scope, query_vector):
+        q = np.asarray(query_vector, dtype=np.float32)
+        q /= (np.linalg.norm(q) or 1.0)
+        with self.lock:
+            best_key, best_score = None, self.similarity
+            for key, entry in list(self.entries.items()):
+                if self._expired(entry):
+                    self._remove(key)
+                    continue
+                if entry["scope"] != scope or len(entry["vector"]) != len(q):
+                    continue
+                score = float(entry["vector"] @ q)
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is None:
+                self.counters["misses"] += 1
+                return None
+            self.entries.move_to_end(best_key)
+            self.counters["semantic_hits"] += 1
+            return self.entries[best_key]
+
+    def put(self, key, scope, query_vector, response, context, collection_names, versions):
+        """Cache an answer unless a collection it used changed since `versions` was taken"""
+        if query_vector is None:
+            # Keyword-only queries were never embedded, they can only be hit exactly
+            vector = np.empty(0, dtype=np.float32)
+        else:
+            vector = np.asarray(query_vector, dtype=np.float32)
+            vector = vector / (np.linalg.norm(vector) or 1.0)
+        size = vector.nbytes + len(response) + sum(len(c) for c in context) + len(key[0]) + 256
+        with self.lock:
+            if any(self.collection_versions.get(name, 0) != versions.get(name, 0) for name in collection_names):
+                return
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = {
+                "scope": scope, "vector": vector, "response": response, "context": context,
+                "collections": frozenset(collection_names), "created_at": time.time(), "size": size
+            }
+            self.bytes += size
+            while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+                self._remove(next(iter(self.entries)))
+                self.counters["evictions"] += 1
+
+    def invalidate(self, coll_name):
+        """Drop every answer that used `coll_name`"""
+        with self.lock:
+            self.collection_versions[coll_name] = self.collection_versions.get(coll_name, 0) + 1
+            for key in [k for k, e in self.entries.items() if coll_name in e["collections"]]:
+                self._remove(key)
+                self.counters["invalidations"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counters["exact_hits"] + self.counters["semantic_hits"] + self.counters["misses"]
+            hits = self.counters["exact_hits"] + self.counters["semantic_hits"]
+            return {
+                **self.counters,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+                "entries": len(self.entries),
+                "bytes": self.bytes
+            }
+
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_MAX_BYTES,
+                               RESPONSE_CACHE_TTL_SECONDS, RESPONSE_CACHE_SIMILARITY)
+
+# Document counts per MongoDB collection, counted once and then kept up to date by
+# notify_collection_changed, so the collection endpoints don't run count_documents per request
+collection_counts = {}
+collection_count_generations = {}
+collection_counts_lock = threading.Lock()
+
+def notify_collection_changed(coll_name: str, delta: Optional[int] = None):
+    """Called whenever documents are added to or removed from a collection.
+
+    `delta` is the change in the number of documents; None (e.g. after a clear) drops the
+    cached count so it is counted again on next use.
+    """
+    response_cache.invalidate(coll_name)
+    bump_collection_version(coll_name)
+    with collection_counts_lock:
+        collection_count_generations[coll_name] = collection_count_generations.get(coll_name, 0) + 1
+        if delta is None:
+            collection_counts.pop(coll_name, None)
+        elif coll_name in collection_counts:
+            collection_counts[coll_name] += delta
+
+def collection_count(coll, exact: bool = True):
+    """Document count of a collection: the cached counter, else a full count (or with `exact=False`
+    MongoDB's metadata-based estimate, which is O(1) but may be off after an unclean shutdown)"""
+    with collection_counts_lock:
+        if coll.name in collection_counts:
+            return collection_counts[coll.name]
+        generation = collection_count_generations.get(coll.name, 0)
+    if not exact:
+        return coll.estimated_document_count()
+    count = coll.count_documents({})
+    with collection_counts_lock:
+        # A count that raced with inserts/deletes is returned but not cached
+        if collection_count_generations.get(coll.name, 0) == generation:
+            collection_counts[coll.name] = count
+    return count
+
+# Query embedding cache settings
+QUERY_EMBEDDING_CACHE_SIZE = 4096
+QUERY_EMBEDDING_CACHE_FILE = os.path.join(app_data_dir, "query_embeddings.npz")  # None = memory only
+QUERY_EMBEDDING_CACHE_SAVE_EVERY = 50  # New entries between saves to disk
+
+class QueryEmbeddingCache:
+    """Bounded LRU of query embeddings keyed by (embedding model, query text), optionally persisted"""
+
+    def __init__(self, max_entries, path=None, save_every=50):
+        self.max_entries = max_entries
+        self.path = path
+        self.save_every = save_every
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        # Saves triggered by put run here, off the request thread
+        self.save_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query-cache")
+        self.entries = OrderedDict()
+        self.unsaved = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, model: str, text: str):
+        with self.lock:
+            vector = self.entries.get((model, text))
+            if vector is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end((model, text))
+            self.hits += 1
+            return vector
+
+    def put(self, model: str, text: str, vector):
+        with self.lock:
+            self.entries[(model, text)] = np.asarray(vector, dtype=np.float32)
+            self.entries.move_to_end((model, text))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.unsaved += 1
+            should_save = self.path and self.unsaved >= self.save_every
+            if should_save:
+                self.unsaved = 0
+        if should_save:
+            self.save_executor.submit(self.save_in_background)
+
+    def save_in_background(self):
+        try:
+            self.save()
+        except Exception as e:
+            log_error(f"Could not save query embedding cache: {str(e)}")
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            items = list(self.entries.items())
+            self.unsaved = 0
+        by_model = {}
+        for (model, text), vector in items:
+            by_model.setdefault(model, ([], []))
+            by_model[model][0].append(text.encode("utf-8"))
+            by_model[model][1].append(vector)
+        # Texts are stored as one UTF-8 blob plus offsets: a fixed-width string array would
+        # pad every query to the longest one
+        arrays = {"models": np.array(list(by_model), dtype=str)}
+        for i, (texts, vectors) in enumerate(by_model.values()):
+            arrays[f"text_blob_{i}"] = np.frombuffer(b"".join(texts), dtype=np.uint8)
+            arrays[f"text_offsets_{i}"] = np.cumsum([0] + [len(text) for text in texts], dtype=np.int64)
+            arrays[f"vectors_{i}"] = np.stack(vectors)
+        with self.save_lock:
+            tmp_path = self.path + ".tmp.npz"
+            np.savez(tmp_path, **arrays)
+            os.replace(tmp_path, self.path)
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        with np.load(self.path, allow_pickle=False) as data:
+            with self.lock:
+                for i, model in enumerate(data["models"]):
+                    if f"text_blob_{i}" not in data.files:
+                        # Written by an older version
+                        continue
+                    blob = data[f"text_blob_{i}"].tobytes()
+                    offsets = data[f"text_offsets_{i}"]
+                    for j, vector in enumerate(data[f"vectors_{i}"]):
+                        text = blob[offsets[j]:offsets[j + 1]].decode("utf-8")
+                        self.entries[(str(model), text)] = vector
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "entries": len(self.entries)
+            }
+
+query_embedding_cache = QueryEmbeddingCache(QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_FILE,
+                                            QUERY_EMBEDDING_CACHE_SAVE_EVERY)
+
+@app.on_event("startup")
+def load_query_embedding_cache():
+    try:
+        query_embedding_cache.load()
+    except Exception as e:
+        print(f"⚠️  Could not load query embedding cache: {str(e)}")
+
+@app.on_event("shutdown")
+def save_query_embedding_cache():
+    try:
+        query_embedding_cache.save()
+    except Exception as e:
+        log_error(f"Could not save query embedding cache: {str(e)}")
+
+# Micro-batching: query embeddings and vector searches of concurrent chat requests that arrive
+# within MICRO_BATCH_WINDOW_MS share one embed_documents call / one matrix-matrix product
+MICRO_BATCHING = True
+MICRO_BATCH_WINDOW_MS = 2.0
+MICRO_BATCH_MAX = 32
+
+def embed_query_batch(model: str, texts):
+    unique = list(dict.fromkeys(texts))
+    vectors = dict(zip(unique, ollama_clients.embed_documents(model, unique)))
+    return [vectors[text] for text in texts]
+
+query_embedding_batcher = MicroBatcher(embed_query_batch, MICRO_BATCH_WINDOW_MS, MICRO_BATCH_MAX)
+
 def get_embeddings(text: str, model: str):
-    embeddings = OllamaEmbeddings(model=model, base_url=OLLAMA_BASE_URL)
-    return embeddings.embed_query(text)
+    """Embed a query, served from the query embedding cache when possible"""
+    vector = query_embedding_cache.get(model, text)
+    if vector is None:
+        if MICRO_BATCHING:
+            vector = query_embedding_batcher(model, text)
+        else:
+            vector = ollama_clients.embed_query(model, text)
+        query_embedding_cache.put(model, text, vector)
+    return vector
 
 @app.get("/api/models")
 def get_models():
     # Fetch models from Ollama
-    import requests
     try:
-        response = requests.get(f"{OLLAMA_BASE_URL}/api/tags")
+        response = ollama_clients.get("/api/tags", timeout=10)
         if response.status_code == 200:
             models = [m["name"] for m in response.json()["models"]]
             return {"models": models}
@@ -179,12 +983,12 @@ def get_models():
     return {"models": []}
 
 @app.get("/api/collections/stats")
-def get_collection_stats():
-    """Get document counts for each collection"""
+def get_collection_stats(exact: bool = True):
+    """Get document counts for each collection (`exact=false` allows estimated counts for uncached collections)"""
     stats = {}
     total = 0
-    for name, coll in collections.items():
-        count = coll.count_documents({})
+    for name, coll in refresh_collection_registry().items():
+        count = collection_count(coll, exact)
         stats[name] = count
         total += count
     stats["total"] = total
@@ -196,6 +1000,8 @@ def clear_collection(collection_name: str):
     if collection_name not in collections:
         raise HTTPException(status_code=404, detail="Collection not found")
     result = collections[collection_name].delete_many({})
+    drop_vector_indexes(collections[collection_name].name, delete_segments=True)
+    notify_collection_changed(collections[collection_name].name)
     return {"deleted": result.deleted_count}
 
 @app.delete("/api/collections")
@@ -205,6 +1011,8 @@ def clear_all_collections():
     for coll in collections.values():
         result = coll.delete_many({})
         total_deleted += result.deleted_count
+        drop_vector_indexes(coll.name, delete_segments=True)
+        notify_collection_changed(coll.name)
     return {"deleted": total_deleted}
 
 @app.post("/api/collections/create")
@@ -232,8 +1040,8 @@ def create_collection(request: CreateCollectionRequest):
     collections[sanitized_name] = db[coll_name]
     print(f"✅ Created MongoDB collection: {coll_name}")
     
-    # Create an index for better performance
-    collections[sanitized_name].create_index("embedding_model")
+    # Create indexes for better performance
+    ensure_collection_indexes(collections[sanitized_name])
     print(f"✅ Created index for collection: {sanitized_name}")
     
     return {
@@ -243,23 +1051,46 @@ def create_collection(request: CreateCollectionRequest):
     }
 
 @app.get("/api/collections/list")
-def list_all_collections():
-    """List all available collections including custom ones"""
-    load_all_collections()  # Refresh collections
+def list_all_collections(exact: bool = True, refresh: bool = False):
+    """List all available collections including custom ones; `refresh=true` re-reads the registry and recounts"""
+    if refresh:
+        with collection_counts_lock:
+            collection_counts.clear()
+    refresh_collection_registry(force=refresh)
     
     collection_info = []
-    for name, coll in collections.items():
-        count = coll.count_documents({})
+    for name, coll in list(collections.items()):
+        count = collection_count(coll, exact)
         is_default = name in DEFAULT_COLLECTIONS
         collection_info.append({
             "name": name,
             "count": count,
             "is_default": is_default,
-            "mongodb_name": coll.name
+            "mongodb_name": coll.name,
+            "quantization": get_collection_quantization(coll.name)
         })
     
     return {"collections": collection_info}
 
+@app.put("/api/collections/{collection_name}/quantization")
+def set_collection_quantization(collection_name: str, request: QuantizationRequest):
+    """Enable an offered quantization for a collection's vector search (or disable it with null).
+
+    Quantized collections keep only compact codes hot (int8 4x, PQ 16x smaller than the vectors)
+    at the cost of slower searches; PQ also misses some of the exact top results.
+    """
+    if collection_name not in collections:
+        raise HTTPException(status_code=404, detail="Collection not found")
+    if request.quantization is not None and request.quantization not in OFFERED_QUANTIZATIONS:
+        allowed = ", ".join(["null", *(f"'{mode}'" for mode in OFFERED_QUANTIZATIONS)])
+        raise HTTPException(status_code=400, detail=f"Quantization must be one of: {allowed}")
+    coll_name = collections[collection_name].name
+    collection_settings_coll.update_one({"_id": coll_name}, {"$set": {"quantization": request.quantization}}, upsert=True)
+    collection_settings.setdefault(coll_name, {"_id": coll_name})["quantization"] = request.quantization
+    # Indexes are rebuilt with the new setting on next use
+    drop_vector_indexes(coll_name)
+    return {"status": "success", "collection": collection_name, "quantization": request.quantization}
+
 @app.delete("/api/collections/custom/{collection_name}")
 def delete_custom_collection(collection_name: str):
     """Delete a custom collection (cannot delete default collections)"""
@@ -272,284 +1103,1153 @@ def delete_custom_collection(collection_name: str):
     # Drop the collection from MongoDB
     coll_name = f"documents_{collection_name}"
     db.drop_collection(coll_name)
+    drop_vector_indexes(coll_name, delete_segments=True)
+    indexed_collections.discard(coll_name)
+    notify_collection_changed(coll_name)
+    collection_settings_coll.delete_one({"_id": coll_name})
+    collection_settings.pop(coll_name, None)
     
     # Remove from collections dict
     del collections[collection_name]
     
     return {"status": "success", "deleted": collection_name}
 
+DEDUPLICATE_CHUNKS = True  # Re-uploads only embed chunks that changed
+
+def chunk_fingerprint(content: str, embedding_model: str):
+    """Hash of the normalised chunk text and the embedding model that embeds it"""
+    normalized = " ".join(unicodedata.normalize("NFC", content).split())
+    return hashlib.sha256(f"{embedding_model}\x00{normalized}".encode("utf-8")).hexdigest()
+
+def plan_incremental_ingest(chunks, filename: str, embedding_model: str, collection_to_use):
+    """Compare new chunks with what is stored for the same file.
+
+    Returns (chunks_to_embed, ids_to_delete, unchanged_count): chunks whose
+    fingerprint is already stored are skipped, stored chunks that no longer
+    appear in the file (or are duplicates) are scheduled for deletion.
+    """
+    plan = {}
+    to_embed = [chunk for chunk, _ in filter_new_chunks(((chunk, None) for chunk in chunks), filename,
+                                                          embedding_model, collection_to_use, plan)]
+    return to_embed, plan["to_delete"], plan["unchanged"]
+
+def filter_new_chunks(items, filename: str, embedding_model: str, collection_to_use, plan):
+    """Streaming form of plan_incremental_ingest over (chunk, extra) items.
+
+    Yields the items whose chunk is not stored yet; once exhausted, `plan`
+    holds "to_delete" (stored ids no longer in the file), "unchanged" and
+    "page_updates" (kept chunks whose page range moved, see update_unchanged_chunks).
+    """
+    stored = {}
+    legacy_ids = []
+    stored_pages = {}
+    query = {"filename": filename, "embedding_model": embedding_model}
+    for doc in collection_to_use.find(query, {"fingerprint": 1, "page": 1, "page_end": 1}):
+        if "page" in doc:
+            stored_pages[doc["_id"]] = (doc["page"], doc.get("page_end"))
+        if "fingerprint" in doc:
+            stored.setdefault(doc["fingerprint"], []).append(doc["_id"])
+        else:
+            legacy_ids.append(doc["_id"])
+    if legacy_ids:
+        # Chunks stored before fingerprinting: compute and save their fingerprints once
+        updates = []
+        for doc in collection_to_use.find({"_id": {"$in": legacy_ids}}, {"content": 1}):
+            fingerprint = chunk_fingerprint(doc.get("content", ""), embedding_model)
+            stored.setdefault(fingerprint, []).append(doc["_id"])
+            updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"fingerprint": fingerprint}}))
+        if updates:
+            collection_to_use.bulk_write(updates, ordered=False)
+
+    # A chunk whose vector is missing from the index can't be retrieved: store it again
+    unindexed = []
+    index = get_vector_index(collection_to_use, embedding_model)
+    for fingerprint, ids in list(stored.items()):
+        indexed = [doc_id for doc_id in ids if doc_id in index]
+        unindexed.extend(doc_id for doc_id in ids if doc_id not in index)
+        if indexed:
+            stored[fingerprint] = indexed
+        else:
+            del stored[fingerprint]
+
+    seen, new, page_updates = set(), 0, []
+    for item in items:
+        fingerprint = chunk_fingerprint(item[0], embedding_model)
+        if fingerprint in seen:
+            continue
+        seen.add(fingerprint)
+        if fingerprint not in stored:
+            new += 1
+            yield item
+        elif item[1] and stored_pages.get(stored[fingerprint][0]) != tuple(item[1]):
+            # The copy that is kept (see below) takes the pages the chunk comes from now
+            page_updates.append((stored[fingerprint][0], item[1]))
+
+    to_delete = unindexed
+    for fingerprint, ids in stored.items():
+        # Keep one copy of every chunk that is still in the file
+        to_delete.extend(ids if fingerprint not in seen else ids[1:])
+    plan["to_delete"] = to_delete
+    plan["unchanged"] = len(seen) - new
+    plan["page_updates"] = page_updates
+
+def update_unchanged_chunks(collection_to_use, filename: str, embedding_model: str, plan, fields):
+    """Give the chunks kept from an earlier upload the metadata of this one and their current pages"""
+    if not plan["unchanged"]:
+        return
+    collection_to_use.update_many({"filename": filename, "embedding_model": embedding_model}, {"$set": fields})
+    updates = [UpdateOne({"_id": doc_id}, {"$set": {"page": page_range[0], "page_end": page_range[1]}})
+               for doc_id, page_range in plan.get("page_updates", [])]
+    for start in range(0, len(updates), INSERT_BATCH_SIZE):
+        collection_to_use.bulk_write(updates[start:start + INSERT_BATCH_SIZE], ordered=False)
+
+# Content-addressed embedding store shared by all collections and files
+EMBEDDING_STORE_ENABLED = True
+EMBEDDING_STORE_MEMORY_ENTRIES = 10000  # Hot entries kept in process
+EMBEDDING_STORE_MAX_ENTRIES = 500000  # Entries kept in MongoDB, least recently used are pruned
+EMBEDDING_STORE_TTL_DAYS = 90  # Entries unused for this long expire
+EMBEDDING_STORE_PRUNE_EVERY = 5000  # New entries between size checks
+
+class EmbeddingStore:
+    """Embeddings keyed by chunk fingerprint (content hash + embedding model).
+
+    Repeated text (boilerplate, licence headers, repeated rows) is embedded
+    once in total: an in-process LRU sits in front of a MongoDB collection
+    with a TTL index on `last_used` and a size cap.
+    """
+
+    def __init__(self, coll, memory_entries, max_entries, ttl_days, prune_every):
+        self.coll = coll
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self.ttl_days = ttl_days
+        self.prune_every = prune_every
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()
+        self.inserted_since_prune = 0
+        self.hits = 0
+        self.misses = 0
+
+    def ensure_indexes(self):
+        self.coll.create_index("last_used", expireAfterSeconds=self.ttl_days * 86400)
+
+    def _remember(self, fingerprint, vector):
+        self.memory[fingerprint] = vector
+        self.memory.move_to_end(fingerprint)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def get_many(self, fingerprints):
+        """Return {fingerprint: vector} for the fingerprints that are stored"""
+        found = {}
+        with self.lock:
+            for fingerprint in fingerprints:
+                if fingerprint in self.memory:
+                    self.memory.move_to_end(fingerprint)
+                    found[fingerprint] = self.memory[fingerprint]
+        missing = [fp for fp in set(fingerprints) if fp not in found]
+        if missing:
+            from_db = {
+                doc["_id"]: decode_embedding(doc["embedding"])
+                for doc in self.coll.find({"_id": {"$in": missing}}, {"embedding": 1})
+            }
+            if from_db:
+                self.coll.update_many({"_id": {"$in": list(from_db)}}, {"$set": {"last_used": datetime.now(timezone.utc)}})
+            with self.lock:
+                for fingerprint, vector in from_db.items():
+                    self._remember(fingerprint, vector)
+            found.update(from_db)
+        with self.lock:
+            self.hits += sum(1 for fp in fingerprints if fp in found)
+            self.misses += sum(1 for fp in fingerprints if fp not in found)
+        return found
+
+    def put_many(self, fingerprints, vectors, embedding_model: str):
+        if not fingerprints:
+            return
+        now = datetime.now(timezone.utc)
+        self.coll.bulk_write([
+            UpdateOne(
+                {"_id": fingerprint},
+                {"$set": {"last_used": now}, "$setOnInsert": {"embedding": encode_embedding(vector), "embedding_model": embedding_model}},
+                upsert=True
+            )
+            for fingerprint, vector in zip(fingerprints, vectors)
+        ], ordered=False)
+        with self.lock:
+            for fingerprint, vector in zip(fingerprints, vectors):
+                self._remember(fingerprint, vector)
+            self.inserted_since_prune += len(fingerprints)
+            should_prune = self.inserted_since_prune >= self.prune_every
+            if should_prune:
+                self.inserted_since_prune = 0
+        if should_prune:
+            self.prune()
+
+    def prune(self):
+        """Delete the least recently used entries beyond max_entries"""
+        excess = self.coll.estimated_document_count() - self.max_entries
+        if excess > 0:
+            oldest = [doc["_id"] for doc in self.coll.find({}, {"_id": 1}).sort("last_used", 1).limit(excess)]
+            self.coll.delete_many({"_id": {"$in": oldest}})
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "memory_entries": len(self.memory)
+            }
+
+embedding_store = EmbeddingStore(db["embedding_store"], EMBEDDING_STORE_MEMORY_ENTRIES, EMBEDDING_STORE_MAX_ENTRIES,
+                                 EMBEDDING_STORE_TTL_DAYS, EMBEDDING_STORE_PRUNE_EVERY)
+
+@app.on_event("startup")
+def create_embedding_store_indexes():
+    try:
+        embedding_store.ensure_indexes()
+    except Exception as e:
+        print(f"⚠️  Could not create embedding store indexes: {str(e)}")
+
+def delete_chunks(collection_to_use, embedding_model: str, ids):
+    if not ids:
+        return 0
+    remove_from_lexical_index(collection_to_use, embedding_model, ids)
+    result = collection_to_use.delete_many({"_id": {"$in": ids}})
+    remove_from_vector_index(collection_to_use, embedding_model, ids)
+    notify_collection_changed(collection_to_use.name, -result.deleted_count)
+    return result.deleted_count
+
+def embed_and_store(chunks, filename: str, embedding_model: str, collection_to_use, progress=None,
+                    metadata=None, pages=None):
+    """Embed chunks in batches with a bounded number of requests in flight and store them with insert_many.
+
+    `chunks` can be any iterable (including a generator); results are written in input order.
+    `progress(chunks_done, chunks_per_second)` is called after every embedding batch.
+    `metadata` (file-level fields) is stored with every chunk, `pages` maps chunk text to (first, last) page.
+    Returns ingestion statistics including throughput in chunks/sec.
+    """
+    items = ((chunk, pages.get(chunk) if pages else None) for chunk in chunks)
+    records = chunk_records(items, collection_to_use, {"filename": filename, **(metadata or {})})
+    return embed_and_store_records(records, embedding_model, progress=progress)
+
+def chunk_records(items, collection_to_use, fields):
+    """(chunk, page range or None) items -> (collection, chunk, fields) records for embed_and_store_records"""
+    for chunk, page_range in items:
+        if page_range:
+            yield collection_to_use, chunk, {**fields, "page": page_range[0], "page_end": page_range[1]}
+        else:
+            yield collection_to_use, chunk, fields
+
+def embed_and_store_records(records, embedding_model: str, progress=None, on_stored=None):
+    """The batched embedding/insert pipeline behind embed_and_store.
+
+    `records` yields (collection, chunk, fields) so chunks of many files and
+    collections share the same embedding batches (see run_bulk_ingest).
+    `on_stored(collection, docs)` is called after every insert_many.
+    """
+    started = time.perf_counter()
+    stats = {"chunks_processed": 0, "embedding_batches": 0, "insert_batches": 0, "embeddings_reused": 0}
+    pending = deque()
+    # Documents waiting for insert_many, per collection name: (collection, docs, vectors)
+    buffers = {}
+
+    def flush_docs():
+        for collection_to_use, docs, vectors in buffers.values():
+            if VECTOR_SEGMENT_DIR:
+                # Vectors first: after a failure an orphan vector is skipped at query time,
+                # while a chunk without a vector is not found until its file is uploaded again
+                ids = [ObjectId() for _ in docs]
+                for doc, doc_id in zip(docs, ids):
+                    doc["_id"] = doc_id
+                add_to_vector_index(collection_to_use, embedding_model, ids, vectors)
+                try:
+                    collection_to_use.insert_many(docs, ordered=True)
+                except Exception:
+                    remove_from_vector_index(collection_to_use, embedding_model, ids)
+                    raise
+            else:
+                ids = collection_to_use.insert_many(docs, ordered=True).inserted_ids
+                add_to_vector_index(collection_to_use, embedding_model, ids, vectors)
+            add_to_lexical_index(collection_to_use, embedding_model, ids, [doc["content"] for doc in docs])
+            notify_collection_changed(collection_to_use.name, len(docs))
+            stats["insert_batches"] += 1
+            if on_stored:
+                on_stored(collection_to_use, docs)
+        buffers.clear()
+
+    def submit(batch):
+        # Only text the embedding store has never seen goes to Ollama
+        fingerprints = [chunk_fingerprint(chunk, embedding_model) for _, chunk, _ in batch]
+        known = embedding_store.get_many(fingerprints) if EMBEDDING_STORE_ENABLED else {}
+        missing = {fp: chunk for (_, chunk, _), fp in zip(batch, fingerprints) if fp not in known}
+        future = executor.submit(ollama_clients.embed_documents, embedding_model,
+                                 list(missing.values())) if missing else None
+        pending.append((batch, fingerprints, known, list(missing), future))
+
+    def collect_oldest():
+        batch, fingerprints, known, missing, future = pending.popleft()
+        if future is not None:
+            new_vectors = future.result()
+            stats["embedding_batches"] += 1
+            if EMBEDDING_STORE_ENABLED:
+                embedding_store.put_many(missing, new_vectors, embedding_model)
+            known = {**known, **dict(zip(missing, new_vectors))}
+        stats["embeddings_reused"] += len(batch) - len(missing)
+        for (collection_to_use, chunk, fields), fingerprint in zip(batch, fingerprints):
+            doc = {
+                "content": chunk,
+                "fingerprint": fingerprint,
+                "embedding_model": embedding_model,
+                **fields
+            }
+            doc["embedding"] = encode_embedding(known[fingerprint])
+            _, docs, vectors = buffers.setdefault(collection_to_use.name, (collection_to_use, [], []))
+            docs.append(doc)
+            vectors.append(known[fingerprint])
+            stats["chunks_processed"] += 1
+        if sum(len(docs) for _, docs, _ in buffers.values()) >= INSERT_BATCH_SIZE:
+            flush_docs()
+        if progress:
+            elapsed = time.perf_counter() - started
+            progress(stats["chunks_processed"], round(stats["chunks_processed"] / elapsed, 1) if elapsed > 0 else 0.0)
+
+    with ThreadPoolExecutor(max_workers=EMBED_MAX_IN_FLIGHT) as executor:
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) < EMBED_BATCH_SIZE:
+                continue
+            # Backpressure: never keep more than EMBED_MAX_IN_FLIGHT batches outstanding
+            if len(pending) >= EMBED_MAX_IN_FLIGHT:
+                collect_oldest()
+            submit(batch)
+            batch = []
+        if batch:
+            submit(batch)
+        while pending:
+            collect_oldest()
+    flush_docs()
+
+    elapsed = time.perf_counter() - started
+    stats["elapsed_seconds"] = round(elapsed, 3)
+    stats["chunks_per_second"] = round(stats["chunks_processed"] / elapsed, 1) if elapsed > 0 else 0.0
+    print(f"⚡ Embedded {stats['chunks_processed']} chunks in {elapsed:.2f}s ({stats['chunks_per_second']} chunks/sec)")
+    return stats
+
+# Background ingestion jobs
+# Uploads return a job id immediately; parsing/OCR runs in worker processes,
+# chunking, embedding and inserts run on the ingestion threads.
+INGEST_WORKERS = 2  # Uploads processed concurrently
+PARSE_PROCESSES = max(1, min(4, (os.cpu_count() or 2) - 1))
+# Files at least this large are extracted and chunked as a stream on the ingestion thread
+# instead of being parsed whole in a worker process
+STREAM_EXTRACT_MIN_BYTES = 32 * 1024 * 1024
+STREAM_BUFFER_CHARS = 256 * 1024  # Text buffered before it is chunked when streaming
+JOB_HISTORY_LIMIT = 200  # Finished jobs kept for /api/jobs
+
+jobs = {}
+jobs_lock = threading.Lock()
+ingest_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+parse_executor = None
+
+def get_parse_executor():
+    """Process pool for CPU-heavy parsing, started on first use"""
+    global parse_executor
+    with jobs_lock:
+        if parse_executor is None:
+            parse_executor = ProcessPoolExecutor(max_workers=PARSE_PROCESSES, initializer=init_worker)
+        return parse_executor
+
+def create_job(filename: str, embedding_model: str):
+    job = {
+        "id": uuid.uuid4().hex,
+        "status": "queued",
+        "filename": filename,
+        "embedding_model": embedding_model,
+        "collection": None,
+        "chunks_total": None,
+        "chunks_done": 0,
+        "chunks_per_second": 0.0,
+        "pages_total": None,
+        "pages_done": 0,
+        "error": None,
+        "result": None,
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None
+    }
+    with jobs_lock:
+        jobs[job["id"]] = job
+        finished = [j for j in jobs.values() if j["finished_at"] is not None]
+        if len(finished) > JOB_HISTORY_LIMIT:
+            for old in sorted(finished, key=lambda j: j["finished_at"])[:len(finished) - JOB_HISTORY_LIMIT]:
+                del jobs[old["id"]]
+    return job
+
+def update_job(job, **fields):
+    with jobs_lock:
+        job.update(fields)
+
+text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, add_start_index=True)
+
+def split_pieces(text: str, first_page: int = 1):
+    """Chunk `text`; yields (chunk, first_page, last_page, start) with pages counted from PAGE_BREAKs"""
+    breaks = [match.start() for match in re.finditer(re.escape(PAGE_BREAK), text)]
+    for piece in text_splitter.create_documents([text]):
+        content = piece.page_content
+        start = piece.metadata["start_index"]
+        first = first_page + bisect.bisect_right(breaks, start)
+        last = first_page + bisect.bisect_right(breaks, start + len(content) - 1)
+        yield content.replace(PAGE_BREAK, "\n"), first, last, start
+
+def split_with_pages(text: str):
+    """Chunk `text`; returns (chunks, {chunk: (first_page, last_page)}) with pages found from PAGE_BREAKs"""
+    paged = PAGE_BREAK in text
+    chunks, pages = [], {}
+    for content, first, last, _ in split_pieces(text):
+        if paged:
+            pages.setdefault(content, (first, last))
+        chunks.append(content)
+    return chunks, pages
+
+def iter_chunks(pieces, paged: bool):
+    """Chunk streamed text (see extractors.iter_text) holding only ~STREAM_BUFFER_CHARS in memory.
+
+    Yields (chunk, (first_page, last_page) or None). The last chunk of every
+    buffer is split again together with the text that follows it, so chunk
+    boundaries and overlaps match splitting the whole text closely.
+    """
+    parts, size, page = [], 0, 1
+    for piece in pieces:
+        parts.append(piece)
+        size += len(piece)
+        if size < STREAM_BUFFER_CHARS:
+            continue
+        buffer = "".join(parts)
+        chunks = list(split_pieces(buffer, page))
+        for content, first, last, _ in chunks[:-1]:
+            yield content, (first, last) if paged else None
+        cut = chunks[-1][3] if chunks else len(buffer)
+        page += buffer.count(PAGE_BREAK, 0, cut)
+        parts, size = [buffer[cut:]], len(buffer) - cut
+    for content, first, last, _ in split_pieces("".join(parts), page):
+        yield content, (first, last) if paged else None
+
+def run_upload_job(job, source, filename: str, embedding_model: str, target_collection: Optional[str],
+                   tags: Optional[List[str]] = None):
+    """Parse, chunk, embed and store one uploaded file, recording progress on `job`.
+
+    `source` is the file's bytes or the path of a temporary file (see read_upload), removed when done.
+    """
+    update_job(job, status="parsing", started_at=time.time())
+    metadata = {
+        "uploaded_at": datetime.now(timezone.utc),
+        "source_type": source_type(filename),
+        "tags": tags or []
+    }
+    try:
+        print(f"📁 Processing file: {filename}")
+        # Use specified collection or auto-detect
+        if target_collection and target_collection in collections:
+            collection_to_use = collections[target_collection]
+            print(f"✅ Using specified collection: {target_collection} ({collection_to_use.name})")
+        else:
+            collection_to_use = get_collection_for_file(filename)
+            print(f"🔄 Auto-detected collection: {collection_to_use.name}")
+            if target_collection:
+                print(f"⚠️  Requested collection '{target_collection}' not found, using auto-detect")
+
+        def parse_whole():
+            try:
+                if isinstance(source, bytes) and source_type(filename) not in ("pdf", "word", "excel"):
+                    # Decoding text is cheaper than shipping the bytes to a worker process
+                    text = extract_text(source, filename, False)
+                else:
+                    text = get_parse_executor().submit(extract_text, source, filename, False).result()
+            except ScannedPDFError:
+                # Spread the pages of scanned PDFs over the whole process pool
+                update_job(job, status="ocr")
+                text = ocr_pdf(source, get_parse_executor(),
+                               progress=lambda done, total: update_job(job, pages_done=done, pages_total=total))
+            # Split text, remembering the pages of PDF chunks
+            chunks, pages = split_with_pages(text)
+            if len(chunks) == 0:
+                raise ExtractionError("No content to process after splitting")
+            return [(chunk, pages.get(chunk)) for chunk in chunks]
+
+        def on_progress(chunks_done, chunks_per_second):
+            update_job(job, chunks_done=chunks_done, chunks_per_second=chunks_per_second)
+
+        def store(items, streaming):
+            plan = {"to_delete": [], "unchanged": 0}
+            if DEDUPLICATE_CHUNKS:
+                items = filter_new_chunks(items, filename, embedding_model, collection_to_use, plan)
+            if not streaming:
+                items = list(items)
+            update_job(job, status="embedding", collection=collection_to_use.name,
+                       chunks_total=None if streaming else len(items))
+            records = chunk_records(items, collection_to_use, {"filename": filename, **metadata})
+            stats = embed_and_store_records(records, embedding_model, progress=on_progress)
+            if DEDUPLICATE_CHUNKS:
+                print(f"🧮 {stats['chunks_processed']} new chunks, {plan['unchanged']} unchanged, "
+                      f"{len(plan['to_delete'])} to remove")
+            return stats, plan
+
+        if not isinstance(source, bytes) and os.path.getsize(source) >= STREAM_EXTRACT_MIN_BYTES:
+            # Huge files: pages/reads/rows flow through chunking into the embedding batches
+            try:
+                stats, plan = store(iter_chunks(iter_text(source, filename), filename.lower().endswith(".pdf")),
+                                    streaming=True)
+            except ScannedPDFError:
+                stats, plan = store(parse_whole(), streaming=False)
+        else:
+            stats, plan = store(parse_whole(), streaming=False)
+        stats["chunks_unchanged"] = plan["unchanged"]
+        update_unchanged_chunks(collection_to_use, filename, embedding_model, plan, metadata)
+        stats["chunks_removed"] = delete_chunks(collection_to_use, embedding_model, plan["to_delete"])
+        update_job(job, status="completed", result=stats, chunks_done=stats["chunks_processed"],
+                   chunks_per_second=stats["chunks_per_second"], finished_at=time.time())
+    except ExtractionError as e:
+        update_job(job, status="failed", error=str(e), finished_at=time.time())
+    except Exception as e:
+        log_error(f"Upload error for {filename}: {str(e)}")
+        log_error(traceback.format_exc())
+        update_job(job, status="failed", error=f"Upload failed: {str(e)}", finished_at=time.time())
+    finally:
+        if not isinstance(source, bytes):
+            try:
+                os.remove(source)
+            except OSError:
+                pass
+
+def read_upload(file: UploadFile, job_id: str):
+    """Returns the upload's bytes, or for files over IN_MEMORY_MAX_BYTES the path of a new temporary file.
+
+    Small files are parsed straight from memory (PDFs with fitz.open(stream=...)), so they
+    are never written to UPLOAD_TMP_DIR and read back.
+    """
+    size = file.size
+    if size is None:
+        size = file.file.seek(0, os.SEEK_END)
+    file.file.seek(0)
+    if size <= IN_MEMORY_MAX_BYTES:
+        return file.file.read()
+    # Unique name so concurrent uploads of the same file don't overwrite each other
+    fd, file_path = tempfile.mkstemp(dir=UPLOAD_TMP_DIR, prefix=f"{job_id}_",
+                                     suffix=os.path.splitext(os.path.basename(file.filename or ""))[1])
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            shutil.copyfileobj(file.file, buffer)
+    except Exception:
+        os.remove(file_path)
+        raise
+    return file_path
+
+@app.on_event("startup")
+def clean_upload_dir():
+    """Temporary upload files left behind by a crash; jobs do not survive a restart.
+    Only UPLOAD_TMP_DIR is emptied, files kept directly in UPLOAD_DIR are left alone"""
+    for name in os.listdir(UPLOAD_TMP_DIR):
+        try:
+            os.remove(os.path.join(UPLOAD_TMP_DIR, name))
+        except OSError:
+            pass
+
 @app.post("/api/upload")
 async def upload_file(
     file: UploadFile = File(...), 
     embedding_model: str = "mxbai-embed-large:latest",
-    target_collection: Optional[str] = None
+    target_collection: Optional[str] = None,
+    tags: Optional[str] = None
 ):
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
-    
     print(f"\n📤 UPLOAD REQUEST:")
     print(f"   File: {file.filename}")
     print(f"   Embedding Model: {embedding_model}")
     print(f"   Target Collection: {target_collection}")
+    # Comma-separated custom tags stored with every chunk, usable in chat filters
+    tag_list = [tag.strip() for tag in tags.split(",") if tag.strip()] if tags else []
     
+    job = create_job(file.filename, embedding_model)
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        print(f"📁 Processing file: {file.filename}")
-        
-        # Process file based on extension
-        text = ""
-        file_lower = file.filename.lower()
-        
-        if file_lower.endswith(".pdf"):
-            try:
-                print(f"📄 Reading PDF: {file_path}")
-                doc = fitz.open(file_path)
-                page_count = len(doc)
-                print(f"📄 PDF has {page_count} pages")
-                text_parts = []
-                
-                # Try to extract text normally first
-                for page_num in range(page_count):
-                    page = doc[page_num]
-                    page_text = page.get_text()
-                    if page_text and page_text.strip():
-                        text_parts.append(page_text)
-                        print(f"   Page {page_num+1}: {len(page_text)} characters")
-                
-                doc.close()
-                text = "\n".join(text_parts)
-                print(f"📄 Total text extracted: {len(text)} characters")
-                
-                # If no text found, try OCR
-                if not text.strip():
-                    if not OCR_AVAILABLE:
-                        raise HTTPException(status_code=400, detail="PDF contains scanned images. OCR libraries not installed. Run: pip install pytesseract pillow")
-                    
-                    print("📄 No text found, attempting OCR...")
-                    try:
-                        # Reopen PDF and extract images for OCR
-                        doc = fitz.open(file_path)
-                        ocr_text_parts = []
-                        
-                        for page_num in range(min(page_count, 50)):  # Limit to first 50 pages for performance
-                            page = doc[page_num]
-                            # Get page as image
-                            pix = page.get_pixmap(dpi=200)
-                            img_data = pix.tobytes("png")
-                            
-                            # Convert to PIL Image
-                            from io import BytesIO
-                            image = Image.open(BytesIO(img_data))
-                            
-                            # OCR the image
-                            page_text = pytesseract.image_to_string(image, lang='ron+eng')  # Romanian + English
-                            if page_text.strip():
-                                ocr_text_parts.append(page_text)
-                                print(f"   OCR Page {page_num+1}: {len(page_text)} characters")
-                        
-                        doc.close()
-                        text = "\n".join(ocr_text_parts)
-                        print(f"📄 Total OCR text extracted: {len(text)} characters")
-                        
-                        if not text.strip():
-                            raise HTTPException(status_code=400, detail="PDF appears to be empty even after OCR")
-                    except Exception as ocr_error:
-                        print(f"❌ OCR Error: {str(ocr_error)}")
-                        import traceback
-                        traceback.print_exc()
-                        raise HTTPException(status_code=400, detail=f"OCR failed: {str(ocr_error)}. Make sure Tesseract is installed: https://github.com/UB-Mannheim/tesseract/wiki")
-                        
-            except HTTPException:
-                raise
-            except Exception as e:
-                print(f"❌ PDF Error: {str(e)}")
-                print(f"❌ Error type: {type(e).__name__}")
-                import traceback
-                traceback.print_exc()
-                raise HTTPException(status_code=400, detail=f"PDF processing failed: {str(e)}")
-        
-        elif file_lower.endswith((".txt", ".md", ".markdown")):
-            try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    text = f.read()
-            except UnicodeDecodeError:
-                with open(file_path, "r", encoding="latin-1") as f:
-                    text = f.read()
-        
-        elif file_lower.endswith((".py", ".js", ".jsx", ".ts", ".tsx", ".java", ".cpp", ".c", ".h", ".cs", ".go", ".rs", ".rb", ".php")):
-            try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    text = f.read()
-            except UnicodeDecodeError:
-                with open(file_path, "r", encoding="latin-1") as f:
-                    text = f.read()
-        
-        elif file_lower.endswith((".json", ".xml", ".yaml", ".yml", ".toml", ".ini", ".cfg", ".conf")):
-            try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    text = f.read()
-            except UnicodeDecodeError:
-                with open(file_path, "r", encoding="latin-1") as f:
-                    text = f.read()
-        
-        elif file_lower.endswith((".html", ".htm", ".css", ".scss", ".sass")):
-            try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    text = f.read()
-            except UnicodeDecodeError:
-                with open(file_path, "r", encoding="latin-1") as f:
-                    text = f.read()
-        
-        elif file_lower.endswith((".csv", ".tsv")):
-            try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    text = f.read()
-            except UnicodeDecodeError:
-                with open(file_path, "r", encoding="latin-1") as f:
-                    text = f.read()
-        
-        elif file_lower.endswith((".docx", ".doc")):
-            if not DOCX_AVAILABLE:
-                raise HTTPException(status_code=400, detail="Word document support not installed. Run: pip install python-docx")
-            try:
-                doc = DocxDocument(file_path)
-                text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"Word document processing failed: {str(e)}")
-        
-        elif file_lower.endswith((".xlsx", ".xls")):
-            if not EXCEL_AVAILABLE:
-                raise HTTPException(status_code=400, detail="Excel support not installed. Run: pip install openpyxl")
+        source = await run_in_threadpool(read_upload, file, job["id"])
+    except Exception as e:
+        log_error(f"Upload error for {file.filename}: {str(e)}")
+        log_error(traceback.format_exc())
+        update_job(job, status="failed", error=f"Upload failed: {str(e)}", finished_at=time.time())
+        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+    
+    ingest_executor.submit(run_upload_job, job, source, file.filename, embedding_model, target_collection, tag_list)
+    return {"status": "queued", "job_id": job["id"]}
+
+@app.get("/api/jobs")
+def list_jobs():
+    """List recent ingestion jobs, newest first"""
+    with jobs_lock:
+        return {"jobs": sorted((dict(j) for j in jobs.values()), key=lambda j: j["created_at"], reverse=True)}
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    """Status, progress and throughput of one ingestion job"""
+    with jobs_lock:
+        if job_id not in jobs:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return dict(jobs[job_id])
+
+# Bulk ingestion of a directory or zip archive
+# Files are parsed BULK_PARSE_AHEAD at a time on the parse pool while their chunks stream through
+# one shared embedding/insert pipeline. Finished files are checkpointed in MongoDB so a run that
+# crashed or was stopped continues where it left off.
+BULK_PARSE_AHEAD = PARSE_PROCESSES * 2
+ingest_checkpoints_coll = db["ingest_checkpoints"]
+
+def is_within(path: str, root: str):
+    """True if `path` resolves (following symlinks) to `root` or somewhere below it"""
+    path, root = os.path.realpath(path), os.path.realpath(root)
+    try:
+        return os.path.commonpath([path, root]) == root
+    except ValueError:
+        # Different drives on Windows
+        return False
+
+def bulk_source_files(source: str):
+    """Returns (name, size, modified) for every supported file of a directory or zip archive"""
+    files = []
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or info.filename.startswith("__MACOSX/"):
+                    continue
+                files.append((info.filename, info.file_size, "%04d-%02d-%02dT%02d:%02d:%02d" % info.date_time))
+    else:
+        for root, dirs, names in os.walk(source):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            for name in sorted(names):
+                if name.startswith("."):
+                    continue
+                # Like the directories os.walk skips, files linked from outside the tree are not read
+                if not is_within(os.path.join(root, name), source):
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                rel = os.path.relpath(os.path.join(root, name), source).replace(os.sep, "/")
+                files.append((rel, stat.st_size, stat.st_mtime))
+    return [f for f in files if source_type(f[0]) != "other"]
+
+def bulk_checkpoint_key(source: str, embedding_model: str, target_collection: Optional[str]):
+    key = f"{os.path.abspath(source)}|{embedding_model}|{target_collection or ''}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+def run_bulk_ingest(source: str, embedding_model: str, target_collection: Optional[str] = None,
+                    tags: Optional[List[str]] = None, resume: bool = True, job=None):
+    """Ingest every supported file of a directory or zip archive; returns a summary with files/sec and chunks/sec"""
+    started = time.perf_counter()
+    is_archive = zipfile.is_zipfile(source)
+    files = bulk_source_files(source)
+    run_key = bulk_checkpoint_key(source, embedding_model, target_collection)
+    if not resume:
+        ingest_checkpoints_coll.delete_many({"run": run_key})
+    done = {doc["file"]: (doc["size"], doc["modified"])
+            for doc in ingest_checkpoints_coll.find({"run": run_key}, {"file": 1, "size": 1, "modified": 1})}
+    todo = [f for f in files if done.get(f[0]) != (f[1], f[2])]
+    summary = {"files_total": len(files), "files_skipped": len(files) - len(todo), "files_ingested": 0,
+               "files_failed": [], "chunks_unchanged": 0, "chunks_removed": 0}
+    print(f"📦 Bulk ingest of {source}: {len(todo)} files to process, {summary['files_skipped']} already done")
+    if job is not None:
+        update_job(job, status="parsing", started_at=time.time(), files_total=len(files),
+                   files_done=summary["files_skipped"])
+    metadata = {"uploaded_at": datetime.now(timezone.utc), "tags": tags or []}
+    # Per file: [chunks waiting for insert_many, all chunks yielded, size, modified];
+    # the file is checkpointed once all its chunks are yielded and stored
+    remaining = {}
+
+    def checkpoint(name, size, modified):
+        ingest_checkpoints_coll.update_one(
+            {"_id": f"{run_key}:{name}"},
+            {"$set": {"run": run_key, "file": name, "size": size, "modified": modified, "finished_at": time.time()}},
+            upsert=True)
+        summary["files_ingested"] += 1
+        if job is not None:
+            update_job(job, files_done=summary["files_skipped"] + summary["files_ingested"])
+
+    def on_stored(collection_to_use, docs):
+        for doc in docs:
+            entry = remaining[doc["filename"]]
+            entry[0] -= 1
+            if entry[0] == 0 and entry[1]:
+                checkpoint(doc["filename"], *entry[2:])
+
+    def parse(name, size):
+        if size >= STREAM_EXTRACT_MIN_BYTES and not is_archive:
+            return None  # Streamed on this thread when its turn comes
+        if is_archive:
+            return get_parse_executor().submit(extract_archive_member, source, name, False)
+        return get_parse_executor().submit(extract_text, os.path.join(source, name), name, False)
+
+    def ocr_text(name):
+        # Spread the pages of scanned PDFs over the whole process pool, not one worker
+        if is_archive:
+            return ocr_archive_member(source, name, get_parse_executor())
+        return ocr_pdf(os.path.join(source, name), get_parse_executor())
+
+    def file_items(name, future):
+        if future is None:
+            pieces = iter_text(os.path.join(source, name), name)
+            items = iter_chunks(pieces, name.lower().endswith(".pdf"))
             try:
-                wb = load_workbook(file_path, data_only=True)
-                text_parts = []
-                for sheet in wb.worksheets:
-                    text_parts.append(f"Sheet: {sheet.title}\n")
-                    for row in sheet.iter_rows(values_only=True):
-                        row_text = "\t".join([str(cell) if cell is not None else "" for cell in row])
-                        if row_text.strip():
-                            text_parts.append(row_text)
-                text = "\n".join(text_parts)
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"Excel processing failed: {str(e)}")
-        
+                yield from items
+                return
+            except ScannedPDFError:
+                text = ocr_text(name)
         else:
-            # Try as text file
             try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    text = f.read()
-            except:
-                raise HTTPException(status_code=400, detail=f"Unsupported file type: {file.filename}")
-        
-        if not text or len(text.strip()) == 0:
-            raise HTTPException(status_code=400, detail="File is empty or could not be read")
-                
-        # Split text
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        chunks = text_splitter.split_text(text)
-        
-        if len(chunks) == 0:
-            raise HTTPException(status_code=400, detail="No content to process after splitting")
-        
-        # Embed and store in appropriate collection
-        embeddings_model = OllamaEmbeddings(model=embedding_model, base_url=OLLAMA_BASE_URL)
-        
-        # Use specified collection or auto-detect
-        if target_collection and target_collection in collections:
-            collection_to_use = collections[target_collection]
-            print(f"✅ Using specified collection: {target_collection} ({collection_to_use.name})")
-        else:
-            collection_to_use = get_collection_for_file(file.filename)
-            print(f"🔄 Auto-detected collection: {collection_to_use.name}")
-            if target_collection:
-                print(f"⚠️  Requested collection '{target_collection}' not found, using auto-detect")
-        
+                text = future.result()
+            except ScannedPDFError:
+                text = ocr_text(name)
+        chunks, pages = split_with_pages(text)
         for chunk in chunks:
-            vector = embeddings_model.embed_query(chunk)
-            doc = {
-                "filename": file.filename,
-                "content": chunk,
-                "embedding": vector,
-                "embedding_model": embedding_model
-            }
-            collection_to_use.insert_one(doc)
-            
-        return {"status": "success", "chunks_processed": len(chunks)}
-    
-    except HTTPException:
-        raise
+            yield chunk, pages.get(chunk)
+
+    def records():
+        # Backpressure: at most BULK_PARSE_AHEAD parsed files wait for the embedding pipeline
+        queue = deque()
+        upcoming = iter(todo)
+        for entry in islice(upcoming, BULK_PARSE_AHEAD):
+            queue.append((entry, parse(*entry[:2])))
+        while queue:
+            (name, size, modified), future = queue.popleft()
+            for entry in islice(upcoming, 1):
+                queue.append((entry, parse(*entry[:2])))
+            if target_collection and target_collection in collections:
+                collection_to_use = collections[target_collection]
+            else:
+                collection_to_use = get_collection_for_file(name)
+            state = remaining[name] = [0, False, size, modified]
+            fields = {"filename": name, **metadata, "source_type": source_type(name)}
+            plan = {"to_delete": [], "unchanged": 0}
+            try:
+                ensure_collection_indexes(collection_to_use)
+                items = file_items(name, future)
+                if DEDUPLICATE_CHUNKS:
+                    items = filter_new_chunks(items, name, embedding_model, collection_to_use, plan)
+                for record in chunk_records(items, collection_to_use, fields):
+                    state[0] += 1
+                    yield record
+                update_unchanged_chunks(collection_to_use, name, embedding_model, plan, fields)
+                summary["chunks_unchanged"] += plan["unchanged"]
+                summary["chunks_removed"] += delete_chunks(collection_to_use, embedding_model, plan["to_delete"])
+            except Exception as e:
+                # One bad file does not stop the run; it is not checkpointed, so the next run retries it
+                print(f"❌ {name}: {str(e)}")
+                if not isinstance(e, ExtractionError):
+                    log_error(f"Bulk ingest error for {name}: {str(e)}")
+                summary["files_failed"].append({"file": name, "error": str(e)})
+                continue
+            state[1] = True
+            if state[0] == 0:
+                checkpoint(name, size, modified)
+
+    def on_progress(chunks_done, chunks_per_second):
+        if job is not None:
+            update_job(job, status="embedding", chunks_done=chunks_done, chunks_per_second=chunks_per_second)
+
+    stats = embed_and_store_records(records(), embedding_model, progress=on_progress, on_stored=on_stored)
+    elapsed = time.perf_counter() - started
+    files_processed = summary["files_ingested"] + len(summary["files_failed"])
+    summary.update(stats)
+    summary["elapsed_seconds"] = round(elapsed, 3)
+    summary["files_per_second"] = round(files_processed / elapsed, 2) if elapsed > 0 else 0.0
+    summary["chunks_per_second"] = round(stats["chunks_processed"] / elapsed, 1) if elapsed > 0 else 0.0
+    print(f"📦 Bulk ingest finished: {summary['files_ingested']} files, {stats['chunks_processed']} chunks "
+          f"in {elapsed:.2f}s ({summary['files_per_second']} files/sec, {summary['chunks_per_second']} chunks/sec), "
+          f"{len(summary['files_failed'])} failed")
+    return summary
+
+def run_bulk_ingest_job(job, request: BulkIngestRequest):
+    try:
+        summary = run_bulk_ingest(request.path, request.embedding_model, request.target_collection,
+                                  request.tags, request.resume, job=job)
+        update_job(job, status="completed", result=summary, chunks_done=summary["chunks_processed"],
+                   chunks_per_second=summary["chunks_per_second"], finished_at=time.time())
     except Exception as e:
-        log_error(f"Upload error for {file.filename}: {str(e)}")
+        log_error(f"Bulk ingest error for {request.path}: {str(e)}")
         log_error(traceback.format_exc())
-        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+        update_job(job, status="failed", error=f"Bulk ingest failed: {str(e)}", finished_at=time.time())
 
-def cosine_similarity(a, b):
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+@app.post("/api/ingest/bulk")
+def bulk_ingest(request: BulkIngestRequest):
+    """Ingest a directory or zip archive under BULK_INGEST_ROOT as one background job"""
+    if not BULK_INGEST_ROOT:
+        raise HTTPException(status_code=403, detail="Bulk ingest is disabled, use: python main.py ingest <path>")
+    path = os.path.realpath(os.path.join(BULK_INGEST_ROOT, request.path))
+    if not is_within(path, BULK_INGEST_ROOT):
+        raise HTTPException(status_code=403, detail=f"Path must be inside {BULK_INGEST_ROOT}")
+    if not os.path.isdir(path) and not zipfile.is_zipfile(path):
+        raise HTTPException(status_code=400, detail="Path must be a directory or a zip archive")
+    request.path = path
+    job = create_job(os.path.basename(os.path.normpath(path)), request.embedding_model)
+    ingest_executor.submit(run_bulk_ingest_job, job, request)
+    return {"status": "queued", "job_id": job["id"]}
 
-@app.post("/api/chat")
-def chat(request: QueryRequest):
+# Collections are searched concurrently; each returns its own top-k and the lists are merged
+SEARCH_WORKERS = 8
+SEARCH_TOP_K = 5
+search_executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="search")
+
+# Retrieval pipeline: N candidates are retrieved cheaply, re-ranked, and the best k reach the LLM.
+# "none" keeps the retrieval order, "lexical" scores the candidates with BM25 among themselves,
+# "embedding" with exact full-precision cosine, "llm" asks a local model to rate each one
+RERANKER = "none"
+RERANKERS = ("none", "lexical", "embedding", "llm")
+RERANK_CANDIDATES = 20
+MAX_TOP_K = 20
+MAX_CANDIDATES = 100
+RERANK_LLM_MODEL = None  # None = the chat model of the request
+# LLM re-rank calls run on their own pool, so they neither occupy the search workers nor the chat model's
+# Ollama permits; each call times out at the end of the re-rank budget
+RERANK_LLM_WORKERS = 4
+rerank_executor = ThreadPoolExecutor(max_workers=RERANK_LLM_WORKERS, thread_name_prefix="rerank")
+# Time budget per stage: collections that have not answered when the search budget runs out are
+# left out, a re-ranker that runs out of time keeps the retrieval order
+SEARCH_BUDGET_MS = 2000
+RERANK_BUDGET_MS = 1500
+RERANK_LLM_PROMPT = """Rate how well the passage answers the question, from 0 (irrelevant) to 10 (answers it fully). Reply with the number only.
+
+Question: {query}
+
+Passage:
+{passage}
+
+Score:"""
+
+# Context given to the LLM: overlapping chunks of a file are merged, near-duplicates dropped and
+# the rest packed into a token budget; prompt processing dominates on CPU-only Ollama
+CONTEXT_TOKEN_BUDGET = 1500
+CONTEXT_TOKEN_BUDGETS = {}  # Per chat model, e.g. {"llama3.2:1b": 800}
+
+def retrieval_plan(request: QueryRequest):
+    """(k, N, reranker) for a request"""
+    reranker = request.reranker or RERANKER
+    if reranker not in RERANKERS:
+        raise HTTPException(status_code=400, detail=f"reranker must be one of {', '.join(RERANKERS)}")
+    k = request.top_k or SEARCH_TOP_K
+    if not 1 <= k <= MAX_TOP_K:
+        raise HTTPException(status_code=400, detail=f"top_k must be between 1 and {MAX_TOP_K}")
+    n = request.candidates or (RERANK_CANDIDATES if reranker != "none" else k)
+    if not k <= n <= MAX_CANDIDATES:
+        raise HTTPException(status_code=400, detail=f"candidates must be between top_k and {MAX_CANDIDATES}")
+    return k, n, reranker
+
+def llm_relevance(model: str, query: str, passage: str, deadline: float):
+    """Score of one passage, None if the re-rank budget ran out before it was asked"""
+    remaining = deadline - time.perf_counter()
+    if remaining <= 0:
+        return None
+    answer = ollama_clients.generate_within(model, RERANK_LLM_PROMPT.format(query=query, passage=passage), remaining)
+    match = re.search(r"\d+(?:\.\d+)?", answer)
+    return float(match.group()) if match else 0.0
+
+def rerank(request: QueryRequest, reranker: str, query_vector, hits, texts, deadline: float):
+    """Re-score (score, collection, id) hits; returns (hits best first, status).
+
+    `texts` maps ids to chunk text (needed by "lexical" and "llm"). When the budget
+    ends at `deadline` before every hit is scored, the hits come back unchanged.
+    """
+    if reranker == "lexical":
+        scorer = BM25Index()
+        scorer.add(list(range(len(hits))), [texts.get(doc_id, "") for _, _, doc_id in hits])
+        scores = dict((i, score) for score, i in scorer.search(request.query, k=len(hits)))
+        scores = [scores.get(i, 0.0) for i in range(len(hits))]
+    elif reranker == "embedding":
+        by_coll = {}
+        for _, coll, doc_id in hits:
+            by_coll.setdefault(coll.name, (coll, []))[1].append(doc_id)
+        exact = {}
+        for coll, ids in by_coll.values():
+            if time.perf_counter() > deadline:
+                return hits, "timeout"
+            index = get_vector_index(coll, request.embedding_model)
+            exact.update((doc_id, score) for score, doc_id in index.search_subset(query_vector, ids, k=len(ids)))
+        scores = [exact.get(doc_id, -1.0) for _, _, doc_id in hits]
+    else:
+        model = RERANK_LLM_MODEL or request.model
+        futures = [rerank_executor.submit(llm_relevance, model, request.query, texts.get(doc_id, ""), deadline)
+                   for _, _, doc_id in hits]
+        done, pending = wait(futures, timeout=max(0.0, deadline - time.perf_counter()))
+        if pending:
+            # Calls already running end at the deadline by their own timeout, queued ones return at once
+            for future in pending:
+                future.cancel()
+            return hits, "timeout"
+        try:
+            scores = [future.result() for future in futures]
+        except Exception as e:
+            if time.perf_counter() < deadline:
+                raise
+            # A call cut off by the deadline
+            print(f"   ⏱️  LLM re-rank stopped at the deadline: {str(e)}")
+            return hits, "timeout"
+        if None in scores:
+            return hits, "timeout"
+    # Ties keep the retrieval order
+    order = sorted(range(len(hits)), key=lambda i: (-scores[i], i))
+    return [(scores[i], hits[i][1], hits[i][2]) for i in order], "ok"
+
+def retrieval_mode(request: QueryRequest):
+    mode = request.retrieval or RETRIEVAL_MODE
+    if mode not in RETRIEVAL_MODES:
+        raise HTTPException(status_code=400, detail=f"retrieval must be one of {', '.join(RETRIEVAL_MODES)}")
+    return mode
+
+def filter_query(filters: Optional[SearchFilters], embedding_model: str):
+    """MongoDB query selecting the chunks that pass `filters`, None when nothing is filtered"""
+    if filters is None:
+        return None
+    query = {}
+    if filters.filenames:
+        query["filename"] = {"$in": filters.filenames}
+    if filters.source_types:
+        query["source_type"] = {"$in": filters.source_types}
+    if filters.tags:
+        query["tags"] = {"$in": filters.tags}
+    if filters.uploaded_after or filters.uploaded_before:
+        query["uploaded_at"] = {}
+        if filters.uploaded_after:
+            query["uploaded_at"]["$gte"] = filters.uploaded_after
+        if filters.uploaded_before:
+            query["uploaded_at"]["$lte"] = filters.uploaded_before
+    if filters.pages:
+        if len(filters.pages) != 2:
+            raise HTTPException(status_code=400, detail="filters.pages must be [first, last]")
+        # Chunks may span pages: keep those overlapping the range
+        query["page"] = {"$lte": filters.pages[1]}
+        query["page_end"] = {"$gte": filters.pages[0]}
+    if not query:
+        return None
+    query["embedding_model"] = embedding_model
+    return query
+
+def vector_search_batch(key, items):
+    """Score the (query vector, k) items of one (collection, embedding model, nprobe, exact) together"""
+    coll_name, embedding_model, nprobe, exact = key
+    index = get_vector_index(db[coll_name], embedding_model)
+    k = max(item_k for _, item_k in items)
+    results = index.search_batch(np.array([vector for vector, _ in items], dtype=np.float32),
+                                 k=k, nprobe=nprobe, exact=exact)
+    return [hits[:item_k] for hits, (_, item_k) in zip(results, items)]
+
+vector_search_batcher = MicroBatcher(vector_search_batch, MICRO_BATCH_WINDOW_MS, MICRO_BATCH_MAX)
+
+def search_collection(coll, request: QueryRequest, query_vector, k: int, lexical: bool):
+    """Top-k (score, collection, id) vector and keyword hits of one collection, best first,
+    plus its size and search time; vector search is skipped without a query vector.
+    With metadata filters only the matching chunks are scored."""
+    started = time.perf_counter()
+    vector_hits, lexical_hits, size = [], [], 0
+    query = filter_query(request.filters, request.embedding_model)
+    allowed = None
+    if query is not None:
+        allowed = [doc["_id"] for doc in coll.find(query, {"_id": 1})]
+        if not allowed:
+            return [], [], 0, round((time.perf_counter() - started) * 1000, 2)
+    if query_vector is not None:
+        index = get_vector_index(coll, request.embedding_model)
+        if allowed is None:
+            size = len(index)
+            # Quantized first passes score one query at a time, batching would only add the wait
+            if MICRO_BATCHING and index.quantizer is None:
+                key = (coll.name, request.embedding_model, request.nprobe, bool(request.exact))
+                results = vector_search_batcher(key, (query_vector, k))
+            else:
+                results = index.search(query_vector, k=k, nprobe=request.nprobe, exact=request.exact)
+        else:
+            size = len(allowed)
+            results = index.search_subset(query_vector, allowed, k=k)
+        vector_hits = [(score, coll, doc_id) for score, doc_id in results]
+    # Until its keyword index is built a collection answers hybrid queries with vectors only
+    index = get_lexical_index(coll, request.embedding_model, wait=retrieval_mode(request) == "lexical") if lexical else None
+    if index is not None:
+        size = max(size, len(index) if allowed is None else len(allowed))
+        results = index.search(request.query, k=k, ids=set(allowed) if allowed is not None else None)
+        lexical_hits = [(score, coll, doc_id) for score, doc_id in results]
+    return vector_hits, lexical_hits, size, round((time.perf_counter() - started) * 1000, 2)
+
+def fetch_chunks(coll, ids):
+    """Text and filename of the given chunks, by id"""
+    return {doc["_id"]: doc for doc in coll.find({"_id": {"$in": ids}}, {"content": 1, "filename": 1})}
+
+def collections_for_request(request: QueryRequest):
+    if request.collection_filter:
+        return [collections[name] for name in request.collection_filter if name in collections]
+    return list(collections.values())
+
+def start_chat(request: QueryRequest):
+    """Log a chat request, embed its query and look it up in the response cache.
+
+    Returns (cached_entry, query_vector, cache_versions); `query_vector` is None on an exact
+    cache hit and for keyword queries answered from the keyword index alone.
+    """
     print(f"\n🔍 CHAT REQUEST:")
     print(f"   Query: {request.query}")
     print(f"   Model: {request.model}")
     print(f"   Embedding Model: {request.embedding_model}")
     print(f"   Collection Filter: {request.collection_filter}")
     
+    versions = response_cache.versions()
+    key, scope = ResponseCache.keys(request)
+    cached = response_cache.get(key)
+    if cached is not None:
+        print("   ♻️  Response cache hit (exact)")
+        return cached, None, versions
+    
+    mode = retrieval_mode(request)
+    if mode == "lexical" or (mode == "hybrid" and LEXICAL_FAST_PATH
+                             and is_keyword_query(request.query, LEXICAL_FAST_PATH_MAX_TERMS)):
+        print("   🔤 Keyword query, searching without a query embedding")
+        return None, None, versions
+    
     # Embed query
-    embeddings_model = OllamaEmbeddings(model=request.embedding_model, base_url=OLLAMA_BASE_URL)
-    query_vector = embeddings_model.embed_query(request.query)
+    query_vector = get_embeddings(request.query, request.embedding_model)
     
+    cached = response_cache.get_similar(scope, query_vector)
+    if cached is not None:
+        print("   ♻️  Response cache hit (semantic)")
+    return cached, query_vector, versions
+
+def cache_chat_response(request: QueryRequest, query_vector, response: str, top_k, versions):
+    key, scope = ResponseCache.keys(request)
+    collection_names = [coll.name for coll in collections_for_request(request)]
+    response_cache.put(key, scope, query_vector, response, [r[1] for r in top_k], collection_names, versions)
+
+def prepare_chat(request: QueryRequest, query_vector):
+    """Retrieve context for a chat request.
+
+    Returns (prompt, canned_response, top_k, debug): `prompt` is None when there
+    is nothing to send to the LLM, in which case `canned_response` explains why;
+    `debug` holds per-collection search timings.
+    """
     # Determine which collections to search
-    collections_to_search = collections.values()
+    collections_to_search = collections_for_request(request)
     if request.collection_filter:
-        collections_to_search = [collections[name] for name in request.collection_filter if name in collections]
         print(f"   Searching collections: {request.collection_filter}")
     else:
         print(f"   Searching ALL collections ({len(collections)} total)")
     
-    # Retrieve documents from relevant collections only
-    results = []
-    total_docs_searched = 0
-    for coll in collections_to_search:
-        cursor = coll.find({"embedding_model": request.embedding_model})
-        coll_docs = 0
-        for doc in cursor:
-            coll_docs += 1
-            if "embedding" in doc:
-                score = cosine_similarity(query_vector, doc["embedding"])
-                results.append((score, doc["content"], doc.get("filename", "unknown")))
-        total_docs_searched += coll_docs
-        if coll_docs > 0:
-            print(f"   📁 {coll.name}: {coll_docs} documents")
+    mode = retrieval_mode(request)
+    top_n, n_candidates, reranker = retrieval_plan(request)
+    lexical = mode != "vector"
+    k = max(n_candidates, HYBRID_CANDIDATES) if mode == "hybrid" else n_candidates
     
+    def search_all(query_vector):
+        # Query the indexes of every relevant collection concurrently
+        deadline = time.perf_counter() + SEARCH_BUDGET_MS / 1000
+        futures = [
+            (coll, search_executor.submit(search_collection, coll, request, query_vector, k, lexical))
+            for coll in collections_to_search
+        ]
+        vector_lists, lexical_lists, timings = [], [], {}
+        for coll, future in futures:
+            try:
+                vector_hits, lexical_hits, coll_docs, elapsed_ms = future.result(
+                    timeout=max(0.0, deadline - time.perf_counter()))
+            except FutureTimeoutError:
+                print(f"   ⏱️  {coll.name}: no answer within {SEARCH_BUDGET_MS} ms, left out")
+                timings[coll.name] = {"vectors": 0, "vector_hits": 0, "lexical_hits": 0, "ms": None, "timed_out": True}
+                continue
+            vector_lists.append(vector_hits)
+            lexical_lists.append(lexical_hits)
+            timings[coll.name] = {"vectors": coll_docs, "vector_hits": len(vector_hits), "lexical_hits": len(lexical_hits), "ms": elapsed_ms}
+        # Every list is sorted best first, so a k-way merge yields the overall top-k
+        merge = lambda lists: list(islice(heapq.merge(*lists, key=lambda hit: -hit[0]), k))
+        return merge(vector_lists), merge(lexical_lists), timings
+    
+    started = time.perf_counter()
+    vector_ranked, lexical_ranked, timings = search_all(query_vector)
+    if query_vector is None and not lexical_ranked and mode == "hybrid":
+        # Keyword fast path found nothing: embed the query after all
+        print("   🔤 No keyword matches, falling back to vector search")
+        query_vector = get_embeddings(request.query, request.embedding_model)
+        vector_ranked, lexical_ranked, timings = search_all(query_vector)
+    
+    total_docs_searched = 0
+    for coll_name, timing in timings.items():
+        total_docs_searched += timing["vectors"]
+        if timing["vectors"] > 0:
+            print(f"   📁 {coll_name}: {timing['vectors']} documents ({timing['ms']} ms)")
     print(f"   Total documents searched: {total_docs_searched}")
     
-    # Sort and get top results
-    results.sort(key=lambda x: x[0], reverse=True)
-    top_k = results[:5]
+    if vector_ranked and lexical_ranked:
+        # Reciprocal rank fusion: scores of the two retrievers are not comparable, ranks are
+        by_key = {(coll.name, doc_id): coll for _, coll, doc_id in vector_ranked + lexical_ranked}
+        fused = reciprocal_rank_fusion(
+            [[(coll.name, doc_id) for _, coll, doc_id in ranked] for ranked in (vector_ranked, lexical_ranked)],
+            RRF_K, n_candidates
+        )
+        hits = [(score, by_key[key], key[1]) for key, score in fused]
+    else:
+        hits = (vector_ranked or lexical_ranked)[:n_candidates]
+    search_ms = round((time.perf_counter() - started) * 1000, 2)
+    
+    def fetch(hits):
+        # Fetch text only for the given hits, one query per collection involved
+        winners = {}
+        for _, coll, doc_id in hits:
+            winners.setdefault(coll.name, (coll, []))[1].append(doc_id)
+        docs = {}
+        for found in search_executor.map(lambda item: fetch_chunks(*item), winners.values()):
+            docs.update(found)
+        return docs
+    
+    # Re-rank the N candidates within RERANK_BUDGET_MS, then keep the best k
+    started = time.perf_counter()
+    docs, rerank_status = {}, "skipped"
+    if reranker != "none" and len(hits) > 1:
+        if reranker == "embedding" and query_vector is None:
+            query_vector = get_embeddings(request.query, request.embedding_model)
+        if reranker in ("lexical", "llm"):
+            docs = fetch(hits)
+        texts = {doc_id: doc["content"] for doc_id, doc in docs.items()}
+        hits, rerank_status = rerank(request, reranker, query_vector, hits, texts,
+                                     started + RERANK_BUDGET_MS / 1000)
+        print(f"   🔁 Re-ranked {len(texts) or len(hits)} candidates ({reranker}, {rerank_status})")
+    rerank_ms = round((time.perf_counter() - started) * 1000, 2)
+    hits = hits[:top_n]
+    
+    started = time.perf_counter()
+    missing = [hit for hit in hits if hit[2] not in docs]
+    if missing:
+        docs.update(fetch(missing))
+    debug = {"retrieval": mode if query_vector is not None else "lexical", "collections": timings, "search_ms": search_ms,
+             "reranker": reranker, "rerank_status": rerank_status, "rerank_ms": rerank_ms, "candidates": n_candidates,
+             "top_k": top_n, "fetch_ms": round((time.perf_counter() - started) * 1000, 2)}
+    top_k = [
+        (score, docs[doc_id]["content"], docs[doc_id].get("filename", "unknown"))
+        for score, _, doc_id in hits if doc_id in docs
+    ]
     
     print(f"   Top {len(top_k)} results:")
     for i, (score, content, filename) in enumerate(top_k):
         print(f"      {i+1}. Score: {score:.4f} | File: {filename} | Preview: {content[:100]}...")
     
     # Check if we have any documents
+    if total_docs_searched == 0 and any(timing.get("timed_out") for timing in timings.values()):
+        return None, "Searching the documents took too long. Please try again.", [], debug
+    if total_docs_searched == 0 and filter_query(request.filters, request.embedding_model) is not None:
+        return None, "No uploaded documents match the selected filters.", [], debug
     if total_docs_searched == 0:
-        return {
-            "response": "I don't have any documents in my database yet. Please upload some documents first so I can help answer your questions.",
-            "context": []
-        }
+        return None, "I don't have any documents in my database yet. Please upload some documents first so I can help answer your questions.", [], debug
     
     # Check if we found relevant results
     if len(top_k) == 0:
-        return {
-            "response": f"I searched through {total_docs_searched} documents but couldn't find any relevant information to answer your question. Try rephrasing your question or upload more documents related to this topic.",
-            "context": []
-        }
+        return None, f"I searched through {total_docs_searched} documents but couldn't find any relevant information to answer your question. Try rephrasing your question or upload more documents related to this topic.", [], debug
     
-    context = "\n\n".join([r[1] for r in top_k])
+    budget = CONTEXT_TOKEN_BUDGETS.get(request.model, CONTEXT_TOKEN_BUDGET)
+    context, debug["context"] = build_context([(r[2], r[1]) for r in top_k], budget)
+    print(f"   🧩 Context: {debug['context']['raw_tokens']} -> {debug['context']['context_tokens']} tokens "
+          f"({debug['context']['merged']} merged, {debug['context']['duplicates']} duplicates)")
     
     # Generate response with better prompt
-    llm = OllamaLLM(model=request.model, base_url=OLLAMA_BASE_URL)
     prompt = f"""You are a helpful assistant that answers questions based ONLY on the provided context from documents.
 
 Context from documents:
@@ -564,10 +2264,182 @@ Instructions:
 - Do not make up information that isn't in the context
 
 Answer:"""
+    return prompt, None, top_k, debug
+
+@app.post("/api/chat")
+def chat(request: QueryRequest):
+    cached, query_vector, versions = start_chat(request)
+    if cached is not None:
+        return {"response": cached["response"], "context": cached["context"], "cached": True}
     
-    response = llm.invoke(prompt)
-    
-    return {"response": response, "context": [r[1] for r in top_k]}
+    prompt, canned_response, top_k, debug = prepare_chat(request, query_vector)
+    if prompt is None:
+        result = {"response": canned_response, "context": []}
+    else:
+        response = ollama_clients.generate(request.model, prompt)
+        cache_chat_response(request, query_vector, response, top_k, versions)
+        result = {"response": response, "context": [r[1] for r in top_k]}
+    if request.debug:
+        result["debug"] = debug
+    return result
+
+@app.post("/api/chat/stream")
+async def chat_stream(request: QueryRequest, http_request: Request):
+    """Streaming variant of /api/chat, newline-delimited JSON events:
+    {"type": "context", ...} first, then {"type": "token", ...} as the LLM generates, then {"type": "done"},
+    or {"type": "error", "detail": ...} if generation fails after the stream started
+    """
+    cached, query_vector, versions = await run_in_threadpool(start_chat, request)
+    if cached is not None:
+        async def cached_events():
+            yield json.dumps({"type": "context", "context": cached["context"], "cached": True}) + "\n"
+            yield json.dumps({"type": "token", "content": cached["response"]}) + "\n"
+            yield json.dumps({"type": "done"}) + "\n"
+        return StreamingResponse(cached_events(), media_type="application/x-ndjson")
+
+    prompt, canned_response, top_k, debug = await run_in_threadpool(prepare_chat, request, query_vector)
+
+    async def events():
+        context_event = {
+            "type": "context",
+            "context": [r[1] for r in top_k],
+            "sources": [{"filename": r[2], "score": float(r[0])} for r in top_k]
+        }
+        if request.debug:
+            context_event["debug"] = debug
+        yield json.dumps(context_event) + "\n"
+        if prompt is None:
+            yield json.dumps({"type": "token", "content": canned_response}) + "\n"
+            yield json.dumps({"type": "done"}) + "\n"
+            return
+
+        tokens = []
+        try:
+            # Leaving this loop closes the stream to Ollama, which stops generation
+            async for token in ollama_clients.astream(request.model, prompt):
+                if await http_request.is_disconnected():
+                    print("   ⏹️  Client disconnected, generation stopped")
+                    return
+                if token:
+                    tokens.append(token)
+                    yield json.dumps({"type": "token", "content": token}) + "\n"
+        except Exception as e:
+            # The 200 status went out with the context event, so the failure is reported in the stream
+            print(f"❌ Generation failed: {str(e)}")
+            log_error(f"Chat stream error: {str(e)}")
+            yield json.dumps({"type": "error", "detail": f"Generation failed: {str(e)}"}) + "\n"
+            return
+        # Only complete answers are cached
+        cache_chat_response(request, query_vector, "".join(tokens), top_k, versions)
+        yield json.dumps({"type": "done"}) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+@app.get("/api/cache/stats")
+def get_cache_stats():
+    """Hit/miss counters and size of the response cache"""
+    return {
+        "response_cache": response_cache.stats(),
+        "query_embedding_cache": query_embedding_cache.stats(),
+        "embedding_store": embedding_store.stats(),
+        "micro_batching": {"query_embeddings": dict(query_embedding_batcher.stats),
+                           "vector_search": dict(vector_search_batcher.stats)}
+    }
+
+@app.delete("/api/cache")
+def clear_cache():
+    """Clear the response cache (query embeddings stay valid and are kept)"""
+    response_cache.clear()
+    return {"status": "success"}
+
+def collection_size_stats(coll):
+    stats = coll.database.command("collStats", coll.name)
+    return {"documents": stats.get("count", 0), "data_bytes": stats.get("size", 0), "storage_bytes": stats.get("storageSize", 0)}
+
+def time_embedding_scan(coll):
+    """Seconds needed to read and decode every stored embedding of a collection"""
+    started = time.perf_counter()
+    for doc in coll.find({"embedding": {"$exists": True}}, {"embedding": 1}).batch_size(ANN_BUILD_BATCH_SIZE):
+        decode_embedding(doc["embedding"])
+    return round(time.perf_counter() - started, 3)
+
+def migrate_embeddings(dtype: str = None, batch_size: int = 1000, measure_scan: bool = True):
+    """Rewrite stored embeddings in the given storage format, with a before/after size and scan time report"""
+    dtype = dtype or EMBEDDING_STORAGE_DTYPE
+    if dtype != "list" and dtype not in EMBEDDING_BINARY_SUBTYPES:
+        raise ValueError(f"Unknown embedding storage format: {dtype}")
+    report = []
+    for coll in list(collections.values()) + [embedding_store.coll]:
+        before = collection_size_stats(coll)
+        scan_before = time_embedding_scan(coll) if measure_scan else None
+        converted = 0
+        updates = []
+        for doc in coll.find({"embedding": {"$exists": True}}, {"embedding": 1}).batch_size(batch_size):
+            if embedding_encoding(doc["embedding"]) == dtype:
+                continue
+            new_value = encode_embedding(decode_embedding(doc["embedding"]), dtype)
+            updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"embedding": new_value}}))
+            if len(updates) >= batch_size:
+                converted += coll.bulk_write(updates, ordered=False).modified_count
+                updates = []
+        if updates:
+            converted += coll.bulk_write(updates, ordered=False).modified_count
+        if converted:
+            drop_vector_indexes(coll.name)
+        after = collection_size_stats(coll)
+        entry = {"collection": coll.name, "converted": converted, "before": before, "after": after}
+        if measure_scan:
+            entry["scan_seconds_before"] = scan_before
+            entry["scan_seconds_after"] = time_embedding_scan(coll)
+        report.append(entry)
+        print(f"🗜️  {coll.name}: {converted} embeddings -> {dtype}, "
+              f"{before['data_bytes'] / 1e6:.1f} MB -> {after['data_bytes'] / 1e6:.1f} MB")
+    # storage_bytes only shrinks once MongoDB reuses or compacts the freed space
+    return {"dtype": dtype, "collections": report}
+
+@app.post("/api/maintenance/migrate-embeddings")
+def migrate_embeddings_endpoint(dtype: str = EMBEDDING_STORAGE_DTYPE, measure_scan: bool = True):
+    """Convert stored embeddings to another storage format (float32, float16 or list)"""
+    try:
+        return migrate_embeddings(dtype, measure_scan=measure_scan)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def run_cli(argv):
+    """Maintenance commands: python main.py <command> [options]"""
+    import argparse
+    parser = argparse.ArgumentParser(prog="ragulea", description="RAGulea maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate = commands.add_parser("migrate-embeddings", help="Rewrite stored embeddings in a compact format")
+    migrate.add_argument("--dtype", choices=["float32", "float16", "list"], default=EMBEDDING_STORAGE_DTYPE)
+    migrate.add_argument("--batch-size", type=int, default=1000)
+    migrate.add_argument("--no-scan", action="store_true", help="Skip the before/after scan timing")
+    ingest = commands.add_parser("ingest", help="Ingest a directory or zip archive (stop the server first)")
+    ingest.add_argument("path")
+    ingest.add_argument("--embedding-model", default="mxbai-embed-large:latest")
+    ingest.add_argument("--collection", default=None, help="Target collection, default: auto-detect per file")
+    ingest.add_argument("--tags", default="", help="Comma-separated tags stored with every chunk")
+    ingest.add_argument("--restart", action="store_true", help="Ignore files finished by an earlier run")
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate-embeddings":
+        result = migrate_embeddings(args.dtype, args.batch_size, measure_scan=not args.no_scan)
+        print(json.dumps(result, indent=2))
+    elif args.command == "ingest":
+        if not os.path.isdir(args.path) and not zipfile.is_zipfile(args.path):
+            parser.error("path must be a directory or a zip archive")
+        create_collection_indexes()
+        load_collection_settings()
+        tags = [tag.strip() for tag in args.tags.split(",") if tag.strip()]
+        try:
+            result = run_bulk_ingest(args.path, args.embedding_model, args.collection, tags, resume=not args.restart)
+        finally:
+            save_vector_indexes()
+            if parse_executor is not None:
+                parse_executor.shutdown()
+        print(json.dumps(result, indent=2, default=str))
+        return 1 if result["files_failed"] else 0
+    return 0
 
 # Serve Frontend
 # In development, we might run separately, but for the final app, we serve static files.
@@ -607,6 +2479,9 @@ if os.path.exists(frontend_base_path):
     # Mount /assets for other static files
     app.mount("/assets", StaticFiles(directory=os.path.join(frontend_base_path, "assets")), name="static_assets")
 
+if __name__ == "__main__" and len(sys.argv) > 1:
+    sys.exit(run_cli(sys.argv[1:]))
+
 if __name__ == "__main__":
     try:
         import socket as _socket
@@ -0,0 +1,65 @@
+"""Micro-batching of concurrent calls.
+
+Calls with the same key that arrive within a few milliseconds of each other
+are gathered and handed to one batch function, e.g. several chat queries
+embedded with a single embed_documents call, or scored against a vector
+index with one matrix-matrix product.
+"""
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """Run `fn(key, items) -> results` over the items submitted for the same key within `window_ms`.
+
+    There is no background thread: the first caller of a batch waits for the
+    window (or until `max_batch` items are in), runs the batch and hands every
+    other caller its result.
+    """
+
+    def __init__(self, fn, window_ms=2.0, max_batch=32):
+        self.fn = fn
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._cond = threading.Condition()
+        self._pending = {}
+        self.stats = {"batches": 0, "items": 0, "largest_batch": 0}
+
+    def __call__(self, key, item):
+        future = Future()
+        with self._cond:
+            batch = self._pending.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._pending[key] = []
+            batch.append((item, future))
+            if len(batch) >= self.max_batch:
+                # Full batches leave right away; later calls start a new one
+                del self._pending[key]
+                self._cond.notify_all()
+        if leader:
+            deadline = time.monotonic() + self.window
+            with self._cond:
+                while self._pending.get(key) is batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        del self._pending[key]
+                        break
+                    self._cond.wait(remaining)
+            self._run(key, batch)
+        return future.result()
+
+    def _run(self, key, batch):
+        try:
+            results = self.fn(key, [item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+        with self._cond:
+            self.stats["batches"] += 1
+            self.stats["items"] += len(batch)
+            self.stats["largest_batch"] = max(self.stats["largest_batch"], len(batch))
@@ -0,0 +1,144 @@
+"""Minimal stand-in for the Ollama HTTP API, for testing RAGulea without models.
+
+Embeddings are deterministic hashed bag-of-words vectors, so texts that share
+words are similar. Generation echoes a canned answer, streamed word by word.
+
+    python mock_ollama.py --port 11435 --latency-ms 20
+    OLLAMA_BASE_URL=http://localhost:11435 python main.py
+
+GET /mock/stats returns request counters, e.g. to check how many embedding
+round-trips an upload needed.
+"""
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+MODELS = ["mock-embed:latest", "mock-llm:latest"]
+
+
+def embed_text(text, dim):
+    vector = np.zeros(dim, dtype=np.float32)
+    for token in re.findall(r"\w+", text.lower()):
+        digest = hashlib.md5(token.encode("utf-8")).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dim
+        vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[0] = 1.0
+        norm = 1.0
+    return (vector / norm).tolist()
+
+
+class MockOllamaHandler(BaseHTTPRequestHandler):
+    server_version = "MockOllama/0.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _count(self, key, amount=1):
+        with self.server.stats_lock:
+            self.server.stats[key] = self.server.stats.get(key, 0) + amount
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _simulate_latency(self, items=1):
+        delay = self.server.latency_ms + self.server.per_item_ms * items
+        if delay:
+            time.sleep(delay / 1000.0)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": name, "model": name} for name in MODELS]})
+        elif self.path == "/mock/stats":
+            with self.server.stats_lock:
+                self._send_json(dict(self.server.stats))
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        payload = self._read_json()
+        if self.path == "/api/embed":
+            inputs = payload.get("input", "")
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            self._count("embed_requests")
+            self._count("embedded_texts", len(inputs))
+            self._simulate_latency(len(inputs))
+            self._send_json({
+                "model": payload.get("model"),
+                "embeddings": [embed_text(text, self.server.dim) for text in inputs],
+            })
+        elif self.path == "/api/embeddings":
+            self._count("embed_requests")
+            self._count("embedded_texts")
+            self._simulate_latency()
+            self._send_json({"embedding": embed_text(payload.get("prompt", ""), self.server.dim)})
+        elif self.path == "/api/generate":
+            self._count("generate_requests")
+            self._generate(payload)
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def _generate(self, payload):
+        answer = f"Mock answer from {payload.get('model')} based on {len(payload.get('prompt', ''))} prompt characters."
+        created_at = datetime.now(timezone.utc).isoformat()
+        base = {"model": payload.get("model"), "created_at": created_at}
+        if not payload.get("stream", True):
+            self._simulate_latency()
+            self._send_json({**base, "response": answer, "done": True, "done_reason": "stop"})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        for word in answer.split(" "):
+            self._simulate_latency()
+            self.wfile.write((json.dumps({**base, "response": word + " ", "done": False}) + "\n").encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write((json.dumps({**base, "response": "", "done": True, "done_reason": "stop"}) + "\n").encode("utf-8"))
+
+
+def create_server(host="127.0.0.1", port=11435, dim=1024, latency_ms=0.0, per_item_ms=0.0, verbose=False):
+    server = ThreadingHTTPServer((host, port), MockOllamaHandler)
+    server.dim = dim
+    server.latency_ms = latency_ms
+    server.per_item_ms = per_item_ms
+    server.verbose = verbose
+    server.stats = {}
+    server.stats_lock = threading.Lock()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--dim", type=int, default=1024, help="Embedding dimensions")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Simulated latency per request")
+    parser.add_argument("--per-item-ms", type=float, default=0.0, help="Extra latency per embedded text")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    server = create_server(args.host, args.port, args.dim, args.latency_ms, args.per_item_ms, args.verbose)
+    print(f"Mock Ollama listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
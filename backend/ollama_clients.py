@@ -0,0 +1,180 @@
+"""Shared, pooled clients for the Ollama API.
+
+One OllamaEmbeddings/OllamaLLM instance is kept per model, so their httpx
+connection pools (and keep-alive connections) are reused across requests
+instead of being rebuilt for every upload and chat. Every call has a timeout,
+failed connections and "server busy" answers are retried with exponential
+backoff, and a semaphore per model caps the calls Ollama gets at once.
+"""
+import asyncio
+import threading
+import time
+
+import httpx
+import requests
+from langchain_ollama import OllamaEmbeddings, OllamaLLM
+from ollama import ResponseError
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+
+def is_retryable(error):
+    """Connection problems and overload answers are worth another try, model errors are not"""
+    # The ollama client re-raises failed connects as the builtin ConnectionError
+    if isinstance(error, (ConnectionError, httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)):
+        return True
+    return isinstance(error, ResponseError) and error.status_code in RETRY_STATUS_CODES
+
+
+class OllamaClients:
+    """Model-keyed Ollama clients with timeouts, retries and per-model concurrency limits.
+
+    `model_concurrency` overrides `max_concurrency` for single models, e.g.
+    {"llama3.1:70b": 1}.
+    """
+
+    def __init__(self, base_url, connect_timeout=5.0, read_timeout=300.0, retries=2, backoff=0.5,
+                 max_concurrency=4, model_concurrency=None):
+        self.base_url = base_url.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_concurrency = max_concurrency
+        self.model_concurrency = dict(model_concurrency or {})
+        self._lock = threading.Lock()
+        self._embeddings = {}
+        self._llms = {}
+        self._limits = {}
+        self.stats = {"calls": 0, "retries": 0, "failures": 0, "waits": 0}
+
+        # Plain REST calls (model list, health checks) share one keep-alive session
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=max_concurrency * 2, max_retries=Retry(
+            total=retries, backoff_factor=backoff, status_forcelist=RETRY_STATUS_CODES,
+            allowed_methods=frozenset({"GET"})))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _client_kwargs(self, model):
+        # The transports only hold the pool limits: failed connects are retried (with backoff) by
+        # _call/astream alone, transport retries on top would multiply the attempts
+        limits = httpx.Limits(max_connections=self.limit_for(model), max_keepalive_connections=self.limit_for(model))
+        return {
+            "client_kwargs": {"timeout": httpx.Timeout(self.read_timeout, connect=self.connect_timeout)},
+            "sync_client_kwargs": {"transport": httpx.HTTPTransport(retries=0, limits=limits)},
+            "async_client_kwargs": {"transport": httpx.AsyncHTTPTransport(retries=0, limits=limits)},
+        }
+
+    def limit_for(self, model):
+        return self.model_concurrency.get(model, self.max_concurrency)
+
+    def embeddings(self, model):
+        with self._lock:
+            client = self._embeddings.get(model)
+            if client is None:
+                client = self._embeddings[model] = OllamaEmbeddings(
+                    model=model, base_url=self.base_url, **self._client_kwargs(model))
+            return client
+
+    def llm(self, model):
+        with self._lock:
+            client = self._llms.get(model)
+            if client is None:
+                client = self._llms[model] = OllamaLLM(model=model, base_url=self.base_url,
+                                                       **self._client_kwargs(model))
+            return client
+
+    def _limit(self, model):
+        with self._lock:
+            limit = self._limits.get(model)
+            if limit is None:
+                limit = self._limits[model] = threading.BoundedSemaphore(self.limit_for(model))
+            return limit
+
+    def _count(self, stat):
+        # Called from worker threads and the event loop at once
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _call(self, model, fn, *args):
+        limit = self._limit(model)
+        if not limit.acquire(blocking=False):
+            self._count("waits")
+            limit.acquire()
+        try:
+            for attempt in range(self.retries + 1):
+                self._count("calls")
+                try:
+                    return fn(*args)
+                except Exception as e:
+                    if attempt == self.retries or not is_retryable(e):
+                        self._count("failures")
+                        raise
+                    self._count("retries")
+                    time.sleep(self.backoff * 2 ** attempt)
+        finally:
+            limit.release()
+
+    def embed_documents(self, model, texts):
+        return self._call(model, self.embeddings(model).embed_documents, texts)
+
+    def embed_query(self, model, text):
+        return self._call(model, self.embeddings(model).embed_query, text)
+
+    def generate(self, model, prompt):
+        return self._call(model, self.llm(model).invoke, prompt)
+
+    def generate_within(self, model, prompt, timeout):
+        """One plain /api/generate call that gives up after `timeout` seconds.
+
+        Meant for callers with a deadline that bound their own concurrency (the
+        LLM re-ranker): there is no retry and no per-model limit, so these calls
+        don't hold the permits chat generation waits for.
+        """
+        self._count("calls")
+        try:
+            response = self.session.post(f"{self.base_url}/api/generate",
+                                         json={"model": model, "prompt": prompt, "stream": False},
+                                         timeout=(self.connect_timeout, timeout))
+            response.raise_for_status()
+        except Exception:
+            self._count("failures")
+            raise
+        return response.json().get("response", "")
+
+    async def astream(self, model, prompt):
+        """Stream LLM tokens; only failures before the first token are retried"""
+        limit = self._limit(model)
+        if not limit.acquire(blocking=False):
+            self._count("waits")
+            # Polling keeps the event loop free and cannot leak a permit when the request is cancelled
+            while not limit.acquire(blocking=False):
+                await asyncio.sleep(0.02)
+        try:
+            for attempt in range(self.retries + 1):
+                self._count("calls")
+                started = False
+                try:
+                    async for token in self.llm(model).astream(prompt):
+                        started = True
+                        yield token
+                    return
+                except Exception as e:
+                    if started or attempt == self.retries or not is_retryable(e):
+                        self._count("failures")
+                        raise
+                    self._count("retries")
+                    await asyncio.sleep(self.backoff * 2 ** attempt)
+        finally:
+            limit.release()
+
+    def get(self, path, timeout=None):
+        """GET an Ollama REST endpoint through the shared session"""
+        return self.session.get(f"{self.base_url}{path}",
+                                timeout=(self.connect_timeout, timeout if timeout is not None else self.read_timeout))
+
+    def close(self):
+        self.session.close()
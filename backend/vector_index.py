@@ -0,0 +1,891 @@
+"""In-process vector indexes used by the RAGulea backend.
+
+This module only depends on NumPy so it can be imported from worker
+processes and benchmarks without connecting to MongoDB or Ollama.
+"""
+import json
+import os
+import pickle
+import shutil
+import threading
+
+import numpy as np
+
+
+def normalize(vectors):
+    """Return `vectors` as an L2-normalised float32 matrix (one row per vector)"""
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k(scores, k):
+    """Indices of the `k` highest scores, best first"""
+    if k <= 0 or len(scores) == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def spherical_kmeans(vectors, n_clusters, iterations=10, seed=0):
+    """Cluster normalised vectors by cosine similarity, returns the centroids"""
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=n_clusters)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty clusters with random points so every list stays useful
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        centroids = normalize(sums)
+    return centroids
+
+
+def kmeans(vectors, n_clusters, iterations=10, seed=0):
+    """Plain (Euclidean) k-means, returns the centroids"""
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = nearest_centroid(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=n_clusters)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            centroids[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+    return centroids
+
+
+def nearest_centroid(vectors, centroids):
+    # argmin ||x - c||^2 == argmax (x.c - ||c||^2 / 2)
+    return np.argmax(vectors @ centroids.T - 0.5 * (centroids ** 2).sum(axis=1), axis=1)
+
+
+class ScalarQuantizer:
+    """8-bit scalar quantization with a per-dimension range (4x smaller than float32)"""
+
+    def fit(self, vectors):
+        self.low = vectors.min(axis=0)
+        self.scale = (vectors.max(axis=0) - self.low) / 255.0
+        self.scale[self.scale == 0] = 1e-8
+        return self
+
+    def encode(self, vectors):
+        return np.clip(np.rint((vectors - self.low) / self.scale), 0, 255).astype(np.uint8)
+
+    def scorer(self, query):
+        """Function scoring a block of codes against `query` (approximate dot products)"""
+        weights = (query * self.scale).astype(np.float32)
+        offset = float(query @ self.low)
+        return lambda codes: codes @ weights + offset
+
+    @property
+    def code_size(self):
+        return len(self.low)
+
+
+class ProductQuantizer:
+    """Product quantization: each of `n_subspaces` slices of a vector is replaced by
+    the id of its nearest of 256 sub-centroids, so a vector costs `n_subspaces` bytes.
+    Queries are scored with per-subspace lookup tables (asymmetric distance).
+    """
+
+    def __init__(self, n_subspaces=None, iterations=10, sample_size=65536):
+        self.n_subspaces = n_subspaces
+        self.iterations = iterations
+        self.sample_size = sample_size
+
+    def fit(self, vectors):
+        dim = vectors.shape[1]
+        # Default to 4 dimensions per byte, e.g. 256 bytes (16x smaller) for 1024-d embeddings
+        n_subspaces = min(self.n_subspaces or max(1, dim // 4), dim)
+        self.bounds = np.linspace(0, dim, n_subspaces + 1).astype(int)
+        if len(vectors) > self.sample_size:
+            vectors = vectors[np.random.default_rng(0).choice(len(vectors), self.sample_size, replace=False)]
+        self.centroids = [
+            kmeans(np.ascontiguousarray(vectors[:, lo:hi]), 256, self.iterations)
+            for lo, hi in zip(self.bounds[:-1], self.bounds[1:])
+        ]
+        return self
+
+    def encode(self, vectors):
+        codes = np.empty((len(vectors), len(self.centroids)), dtype=np.uint8)
+        for j, (lo, hi) in enumerate(zip(self.bounds[:-1], self.bounds[1:])):
+            codes[:, j] = nearest_centroid(vectors[:, lo:hi], self.centroids[j])
+        return codes
+
+    def scorer(self, query):
+        tables = np.zeros((len(self.centroids), 256), dtype=np.float32)
+        for j, (lo, hi) in enumerate(zip(self.bounds[:-1], self.bounds[1:])):
+            tables[j, :len(self.centroids[j])] = self.centroids[j] @ query[lo:hi]
+        # One gather from the flattened tables: code c of subspace j is entry j * 256 + c,
+        # the offsets are added in 16 bits instead of widening the codes to int64 indices
+        flat = tables.ravel()
+        offsets = (np.arange(len(self.centroids)) * 256).astype(np.uint16 if len(flat) <= 65536 else np.uint32)
+        return lambda codes: flat.take(codes + offsets).sum(axis=1)
+
+    @property
+    def code_size(self):
+        return len(self.centroids)
+
+
+QUANTIZERS = {"int8": ScalarQuantizer, "pq": ProductQuantizer}
+
+
+class VectorSegment:
+    """Append-only on-disk storage for the vectors of one index.
+
+    A segment is a directory holding:
+
+    - `meta.json`: dimensions, committed row count, current generation and stamp
+    - `vectors-<gen>.f32`: raw L2-normalised float32 rows, grown ahead of the row count
+    - `ids-<gen>.bin`: the id of every row as fixed-width ASCII
+    - `deleted-<gen>.i64`: numbers of removed rows (tombstones)
+    - `state-<gen>.pkl`: trained index state, so reopening does not retrain
+
+    Both data files are memory-mapped: opening a segment costs the same at any
+    size and the OS page cache keeps hot vectors resident. Rows are only
+    appended; `rewrite` compacts the live rows into a new generation. Rows
+    written after the last `commit` (e.g. before a crash) are ignored on open.
+
+    `stamp` is an opaque value the owner passes to `commit` to tell later opens
+    which state of the source data the rows match; any other write clears it.
+    """
+
+    # Minimum number of rows the files grow by
+    growth_rows = 16384
+
+    def __init__(self, path, id_width=24, decode_id=None):
+        self.path = path
+        self.id_width = id_width
+        self.decode_id = decode_id or (lambda raw: raw.decode("ascii"))
+        self.dim = None
+        self.size = 0
+        self.generation = 0
+        self.stamp = None
+        self.vectors = None
+        self._id_map = None
+        self._pending_deletes = []
+        if self.exists:
+            with open(os.path.join(self.path, "meta.json")) as f:
+                meta = json.load(f)
+            self.dim, self.size, self.generation = meta["dim"], meta["size"], meta["generation"]
+            self.stamp = meta.get("stamp")
+            self._map()
+
+    @property
+    def exists(self):
+        return os.path.exists(os.path.join(self.path, "meta.json"))
+
+    def _file(self, kind, generation=None):
+        extension = {"vectors": "f32", "ids": "bin", "deleted": "i64", "state": "pkl"}[kind]
+        return os.path.join(self.path, f"{kind}-{self.generation if generation is None else generation}.{extension}")
+
+    def _map(self):
+        """(Re)map the vector and id files at their current on-disk capacity"""
+        self.vectors = self._id_map = None
+        if self.dim is None:
+            return
+        capacity = 0
+        if os.path.exists(self._file("vectors")) and os.path.exists(self._file("ids")):
+            capacity = min(os.path.getsize(self._file("vectors")) // (self.dim * 4),
+                           os.path.getsize(self._file("ids")) // self.id_width)
+        if capacity == 0:
+            self.vectors = np.empty((0, self.dim), dtype=np.float32)
+            self._id_map = np.empty(0, dtype=f"S{self.id_width}")
+            return
+        self.vectors = np.memmap(self._file("vectors"), dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+        self._id_map = np.memmap(self._file("ids"), dtype=f"S{self.id_width}", mode="r+", shape=(capacity,))
+
+    def _write_meta(self):
+        os.makedirs(self.path, exist_ok=True)
+        tmp = os.path.join(self.path, "meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"dim": self.dim, "size": self.size, "generation": self.generation, "stamp": self.stamp}, f)
+        os.replace(tmp, os.path.join(self.path, "meta.json"))
+
+    def _remove_stale(self):
+        """Delete files of older generations (may fail on Windows while still mapped, retried later)"""
+        for name in os.listdir(self.path):
+            if name == "meta.json" or name.split(".")[0].rpartition("-")[2] == str(self.generation):
+                continue
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+
+    def reserve(self, dim, rows):
+        """Grow the files to hold at least `rows` rows, returns the (capacity, dim) vector map"""
+        if self.dim is None:
+            self.dim = dim
+            self.stamp = None
+            self._write_meta()
+        elif dim != self.dim:
+            raise ValueError(f"Expected {self.dim}-dimensional vectors, got {dim}")
+        if self.vectors is None or rows > len(self.vectors):
+            capacity = max(rows, (0 if self.vectors is None else len(self.vectors)) + self.growth_rows)
+            # Drop our maps before resizing the files; callers release theirs first
+            self.vectors = self._id_map = None
+            for kind, row_bytes in (("vectors", dim * 4), ("ids", self.id_width)):
+                with open(self._file(kind), "ab") as f:
+                    f.truncate(capacity * row_bytes)
+            self._map()
+        return self.vectors
+
+    def id(self, row):
+        return self.decode_id(bytes(self._id_map[row]))
+
+    def write_ids(self, start, ids):
+        encoded = [str(doc_id).encode("ascii") for doc_id in ids]
+        if any(len(raw) > self.id_width for raw in encoded):
+            raise ValueError(f"Ids longer than {self.id_width} characters")
+        self._id_map[start:start + len(ids)] = encoded
+
+    def mark_deleted(self, row):
+        self._pending_deletes.append(row)
+
+    def deleted_rows(self):
+        path = self._file("deleted")
+        if not os.path.exists(path):
+            return np.empty(0, dtype=np.int64)
+        rows = np.fromfile(path, dtype="<i8")
+        return np.unique(rows[rows < self.size])
+
+    def commit(self, size, stamp=None):
+        """Make rows [0, size) and pending deletes durable, then record the new row count and stamp"""
+        if self.vectors is not None and isinstance(self.vectors, np.memmap):
+            self.vectors.flush()
+            self._id_map.flush()
+        if self._pending_deletes:
+            with open(self._file("deleted"), "ab") as f:
+                f.write(np.asarray(self._pending_deletes, dtype="<i8").tobytes())
+            self._pending_deletes = []
+        self.size = size
+        self.stamp = stamp
+        self._write_meta()
+
+    def rewrite(self, keep, block_size=65536):
+        """Compact the rows `keep` into a new generation, returns the new vector map"""
+        generation = self.generation + 1
+        with open(self._file("vectors", generation), "wb") as f:
+            for start in range(0, len(keep), block_size):
+                f.write(np.ascontiguousarray(self.vectors[keep[start:start + block_size]]).tobytes())
+        with open(self._file("ids", generation), "wb") as f:
+            f.write(self._id_map[keep].tobytes())
+        self.vectors = self._id_map = None
+        self.generation, self.size = generation, len(keep)
+        self.stamp = None
+        self._pending_deletes = []
+        self._write_meta()
+        self._remove_stale()
+        self._map()
+        return self.vectors
+
+    def clear(self):
+        """Drop every row by starting an empty generation"""
+        self.vectors = self._id_map = None
+        self.dim = None
+        self.size = 0
+        self.generation += 1
+        self.stamp = None
+        self._pending_deletes = []
+        if os.path.isdir(self.path):
+            self._write_meta()
+            self._remove_stale()
+
+    def destroy(self):
+        self.vectors = self._id_map = None
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def save_state(self, state):
+        tmp = self._file("state") + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump({**state, "size": self.size}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._file("state"))
+
+    def load_state(self):
+        """The last saved trained state, or None if missing or unreadable"""
+        try:
+            with open(self._file("state"), "rb") as f:
+                state = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError):
+            return None
+        return state if state.get("size", 0) <= self.size else None
+
+
+class SegmentIds:
+    """Row -> id view over a segment's id file, decoded on access"""
+
+    def __init__(self, segment):
+        self.segment = segment
+
+    def __getitem__(self, row):
+        return self.segment.id(row)
+
+
+class FlatIndex:
+    """Exact cosine search over one contiguous, L2-normalised float32 matrix.
+
+    A query is scored with a single matrix-vector product and the best rows
+    are picked with `argpartition`; a batch of queries is scored with one
+    matrix-matrix product. The matrix can be resident or a read-only
+    `np.memmap` (see `from_matrix`), in which case it is copied into memory
+    only when new vectors are added. An index opened from a `VectorSegment`
+    (see `open`) instead appends to the segment's memory-mapped files.
+
+    With `quantization` ("int8" or "pq") a compressed copy of every vector is
+    kept as well: queries first rank the compressed codes, then re-rank the
+    best `k * rerank_factor` candidates exactly against the full vectors.
+    """
+
+    # Rows scored per matrix product in batch search, bounds the score matrix size
+    block_size = 262144
+    # Rows scored per block in the quantized first pass: int8 codes are widened to float32 and PQ
+    # codes to table offsets, small blocks keep those temporaries in the CPU cache
+    code_block_size = 4096
+    # Quantizers are trained once an index holds this many vectors
+    quantization_min_size = 1024
+
+    def __init__(self, quantization=None, rerank_factor=8, pq_subspaces=None, segment=None):
+        if quantization is not None and quantization not in QUANTIZERS:
+            raise ValueError(f"Unknown quantization: {quantization}")
+        self.quantization = quantization
+        self.rerank_factor = rerank_factor
+        self.pq_subspaces = pq_subspaces
+        self.segment = segment
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.dim = None
+        self.quantizer = None
+        self._codes = None
+        self._quantized_size = 0
+        self._vectors = np.empty((0, 0), dtype=np.float32)
+        self._alive = np.empty(0, dtype=bool)
+        self._ids = SegmentIds(self.segment) if self.segment is not None else []
+        self._row_map = {}
+        self._size = 0
+        self._dead = 0
+
+    @classmethod
+    def from_matrix(cls, ids, matrix, normalized=False, **kwargs):
+        """Wrap an existing (possibly memory-mapped) matrix without copying it"""
+        index = cls(**kwargs)
+        if len(ids) != len(matrix):
+            raise ValueError("ids and matrix must have the same length")
+        if len(ids) == 0:
+            return index
+        index.dim = matrix.shape[1]
+        index._vectors = matrix if normalized else normalize(matrix)
+        index._alive = np.ones(len(ids), dtype=bool)
+        index._ids = list(ids)
+        index._row_map = {doc_id: row for row, doc_id in enumerate(index._ids)}
+        index._size = len(ids)
+        index._after_bulk_load()
+        return index
+
+    @classmethod
+    def open(cls, segment, **kwargs):
+        """Open an index stored in a `VectorSegment` without reading its vectors.
+
+        Trained state saved with `save` is restored; only rows appended since
+        are encoded/assigned again.
+        """
+        index = cls(segment=segment, **kwargs)
+        if segment.size == 0:
+            return index
+        index.dim = segment.dim
+        index._vectors = segment.vectors
+        index._size = segment.size
+        index._alive = np.ones(segment.size, dtype=bool)
+        deleted = segment.deleted_rows()
+        index._alive[deleted] = False
+        index._dead = len(deleted)
+        # The id -> row map is only needed to add or remove, build it then
+        index._row_map = None
+        index._after_open(segment.load_state() or {})
+        return index
+
+    def _after_bulk_load(self):
+        self._maybe_train_quantizer()
+
+    def _after_open(self, state):
+        if (self.quantization is not None and state.get("quantization") == self.quantization
+                and state.get("pq_subspaces") == self.pq_subspaces):
+            codes = state["codes"]
+            self.quantizer = state["quantizer"]
+            self._quantized_size = state["quantized_size"]
+            self._codes = np.zeros((self._size, codes.shape[1]), dtype=np.uint8)
+            self._codes[:len(codes)] = codes
+            if len(codes) < self._size:
+                self._codes[len(codes):] = self.quantizer.encode(self._vectors[len(codes):self._size])
+        self._maybe_train_quantizer()
+
+    def _state(self):
+        """Trained state worth persisting next to a segment"""
+        if self.quantizer is None:
+            return {}
+        return {
+            "quantization": self.quantization,
+            "pq_subspaces": self.pq_subspaces,
+            "quantizer": self.quantizer,
+            "codes": self._codes[:self._size],
+            "quantized_size": self._quantized_size
+        }
+
+    def save(self, stamp=None):
+        """Commit pending rows and trained state to the segment (no-op without one)"""
+        with self._lock:
+            if self.segment is None or self.dim is None:
+                return
+            self.segment.commit(self._size, stamp=stamp)
+            self.segment.save_state(self._state())
+
+    @property
+    def _rows(self):
+        if self._row_map is None:
+            self._row_map = {self._ids[row]: int(row) for row in np.flatnonzero(self._alive[:self._size])}
+        return self._row_map
+
+    def __len__(self):
+        return self._size - self._dead
+
+    def __contains__(self, doc_id):
+        with self._lock:
+            return doc_id in self._rows
+
+    def _reserve(self, extra):
+        needed = self._size + extra
+        if needed <= len(self._alive):
+            return
+        capacity = max(needed, 2 * len(self._alive), 1024)
+        if self.segment is not None:
+            # Grow the files instead of copying; release the old map so it can be resized
+            self._vectors = None
+            self._vectors = self.segment.reserve(self.dim, capacity)
+        else:
+            vectors = np.empty((capacity, self.dim), dtype=np.float32)
+            vectors[:self._size] = self._vectors[:self._size]
+            self._vectors = vectors
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self._size] = self._alive[:self._size]
+        self._alive = alive
+        if self._codes is not None:
+            codes = np.zeros((capacity, self._codes.shape[1]), dtype=np.uint8)
+            codes[:self._size] = self._codes[:self._size]
+            self._codes = codes
+
+    def add(self, ids, vectors):
+        """Add vectors under the given ids (ids must be hashable and unique)"""
+        if len(ids) == 0:
+            return
+        matrix = normalize(vectors)
+        with self._lock:
+            if self.dim is None:
+                self.dim = matrix.shape[1]
+                self._vectors = np.empty((0, self.dim), dtype=np.float32)
+            elif matrix.shape[1] != self.dim:
+                raise ValueError(f"Expected {self.dim}-dimensional vectors, got {matrix.shape[1]}")
+            for doc_id in ids:
+                if doc_id in self._rows:
+                    self._remove_row(self._rows.pop(doc_id))
+            self._reserve(len(ids))
+            start, end = self._size, self._size + len(ids)
+            self._vectors[start:end] = matrix
+            self._alive[start:end] = True
+            for offset, doc_id in enumerate(ids):
+                self._rows[doc_id] = start + offset
+            if self.segment is not None:
+                self.segment.write_ids(start, ids)
+            else:
+                self._ids.extend(ids)
+            self._size = end
+            self._after_add(start, end)
+            if self.segment is not None:
+                self.segment.commit(self._size)
+
+    def _after_add(self, start, end):
+        if self.quantizer is not None:
+            self._codes[start:end] = self.quantizer.encode(self._vectors[start:end])
+        self._maybe_train_quantizer()
+
+    def _maybe_train_quantizer(self):
+        if self.quantization is None or len(self) < max(self.quantization_min_size, 4 * self._quantized_size):
+            return
+        # Train on first reaching the threshold and again as the corpus grows
+        vectors = self._vectors[:self._size]
+        if self.quantization == "pq":
+            quantizer = ProductQuantizer(self.pq_subspaces)
+        else:
+            quantizer = ScalarQuantizer()
+        self.quantizer = quantizer.fit(vectors[self._alive[:self._size]])
+        self._codes = np.zeros((len(self._alive), quantizer.code_size), dtype=np.uint8)
+        for start in range(0, self._size, self.code_block_size):
+            end = min(start + self.code_block_size, self._size)
+            self._codes[start:end] = quantizer.encode(vectors[start:end])
+        self._quantized_size = len(self)
+        self.save()
+
+    @property
+    def memory_usage(self):
+        """Bytes used by the full-precision vectors and by the quantized codes"""
+        return {
+            "vectors": int(self._size * (self.dim or 0) * 4),
+            "codes": int(self._size * self._codes.shape[1]) if self._codes is not None else 0
+        }
+
+    def _remove_row(self, row):
+        if self._alive[row]:
+            self._alive[row] = False
+            self._dead += 1
+            if self.segment is not None:
+                self.segment.mark_deleted(row)
+
+    def remove(self, ids):
+        """Remove vectors by id, unknown ids are ignored"""
+        with self._lock:
+            for doc_id in ids:
+                row = self._rows.pop(doc_id, None)
+                if row is not None:
+                    self._remove_row(row)
+            if self._dead > 1024 and self._dead > self._size // 4:
+                self._compact()
+            if self.segment is not None:
+                self.segment.commit(self._size)
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+            if self.segment is not None:
+                self.segment.clear()
+
+    def _compact(self):
+        keep = np.flatnonzero(self._alive[:self._size])
+        if self.segment is not None:
+            self._vectors = None
+            self._vectors = self.segment.rewrite(keep)
+        else:
+            self._vectors = self._vectors[keep]
+            self._ids = [self._ids[row] for row in keep]
+        self._alive = np.ones(len(keep), dtype=bool)
+        if self._row_map is not None:
+            new_rows = np.full(self._size, -1, dtype=np.int64)
+            new_rows[keep] = np.arange(len(keep))
+            self._row_map = {doc_id: int(new_rows[row]) for doc_id, row in self._row_map.items()}
+        self._size = len(keep)
+        self._dead = 0
+        if self._codes is not None:
+            self._codes = self._codes[keep]
+        return keep
+
+    def _exact_scores(self, queries):
+        """Score every stored row against a (m, dim) query matrix, dead rows get -inf"""
+        scores = self._vectors[:self._size] @ queries.T
+        if self._dead:
+            scores[~self._alive[:self._size]] = -np.inf
+        return scores
+
+    def _results(self, scores, rows, k):
+        best = top_k(scores, k)
+        best = best[np.isfinite(scores[best])]
+        return [(float(scores[i]), self._ids[rows[i] if rows is not None else i]) for i in best]
+
+    def search(self, query, k=5, **kwargs):
+        """Return up to `k` (score, id) pairs ordered by descending cosine similarity"""
+        return self.search_batch(query, k, **kwargs)[0]
+
+    def search_batch(self, queries, k=5, **kwargs):
+        """Search a (m, dim) matrix of queries, returns one result list per query"""
+        matrix = normalize(queries)
+        with self._lock:
+            if len(self) == 0:
+                return [[] for _ in range(len(matrix))]
+            return self._exact_search(matrix, k)
+
+    def search_subset(self, query, ids, k=5):
+        """Exact search restricted to `ids` (unknown ids are ignored), e.g. the result of a metadata filter"""
+        q = normalize(query)[0]
+        with self._lock:
+            rows = np.fromiter((self._rows[doc_id] for doc_id in ids if doc_id in self._rows), dtype=np.int64)
+            if len(rows) == 0:
+                return []
+            return self._results(self._vectors[rows] @ q, rows, k)
+
+    def _quantized_search(self, q, k, rows=None):
+        """Rank compressed codes (all rows, or just `rows`), then re-rank the best candidates exactly"""
+        scorer = self.quantizer.scorer(q)
+        n_candidates = max(k, k * self.rerank_factor)
+        if rows is None:
+            candidates = []
+            for start in range(0, self._size, self.code_block_size):
+                end = min(start + self.code_block_size, self._size)
+                scores = scorer(self._codes[start:end])
+                if self._dead:
+                    scores[~self._alive[start:end]] = -np.inf
+                best = top_k(scores, n_candidates)
+                candidates.append((scores[best], best + start))
+            scores = np.concatenate([c[0] for c in candidates])
+            rows = np.concatenate([c[1] for c in candidates])
+        else:
+            scores = scorer(self._codes[rows])
+        best = top_k(scores, n_candidates)
+        rows = rows[best[np.isfinite(scores[best])]]
+        return self._results(self._vectors[rows] @ q, rows, k)
+
+    def _exact_search(self, matrix, k):
+        if self.quantizer is not None:
+            return [self._quantized_search(q, k) for q in matrix]
+        if self._size <= self.block_size:
+            scores = self._exact_scores(matrix)
+            return [self._results(scores[:, j], None, k) for j in range(len(matrix))]
+        # Large corpora: keep the running top-k of each block instead of one huge score matrix
+        candidates = [[] for _ in range(len(matrix))]
+        for start in range(0, self._size, self.block_size):
+            end = min(start + self.block_size, self._size)
+            scores = self._vectors[start:end] @ matrix.T
+            if self._dead:
+                scores[~self._alive[start:end]] = -np.inf
+            for j in range(len(matrix)):
+                best = top_k(scores[:, j], k)
+                candidates[j].extend((scores[i, j], start + i) for i in best)
+        results = []
+        for j in range(len(matrix)):
+            rows = np.array([row for _, row in candidates[j]])
+            scores = np.array([score for score, _ in candidates[j]], dtype=np.float32)
+            results.append(self._results(scores, rows, k))
+        return results
+
+
+class IVFIndex(FlatIndex):
+    """Inverted-file approximate nearest neighbour index over cosine similarity.
+
+    Vectors are partitioned into `nlist` clusters by spherical k-means; a query
+    only scores the members of its `nprobe` closest clusters. `nprobe` is the
+    recall/latency knob: higher values visit more lists and approach exact
+    search. Until the index holds `min_train_size` vectors it is not trained
+    and every query falls back to the exact `FlatIndex` path, as does any
+    query made with `exact=True`.
+    """
+
+    # Rows copied out of the vector map per step when a training run assigns them
+    train_block_size = 16384
+
+    def __init__(self, nlist=None, nprobe=8, min_train_size=4096, kmeans_iterations=10, train_sample_size=65536, **kwargs):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.kmeans_iterations = kmeans_iterations
+        self.train_sample_size = train_sample_size
+        self._training = False
+        super().__init__(**kwargs)
+
+    def _reset(self):
+        super()._reset()
+        # Bumped whenever row numbers change, so a training run on an older snapshot can tell
+        self._generation = getattr(self, "_generation", 0) + 1
+        self.centroids = None
+        self._assignment = np.empty(0, dtype=np.int32)
+        self._trained_size = 0
+        self._lists = None
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def _reserve(self, extra):
+        capacity = len(self._alive)
+        super()._reserve(extra)
+        if len(self._alive) != capacity:
+            assignment = np.full(len(self._alive), -1, dtype=np.int32)
+            assignment[:self._size] = self._assignment[:self._size]
+            self._assignment = assignment
+
+    def _after_bulk_load(self):
+        self._assignment = np.full(self._size, -1, dtype=np.int32)
+        self._maybe_train()
+        super()._after_bulk_load()
+
+    def _after_open(self, state):
+        self._assignment = np.full(self._size, -1, dtype=np.int32)
+        restored = state.get("centroids") is not None and state.get("nlist") == self.nlist
+        if restored:
+            assignment = state["assignment"]
+            self.centroids = state["centroids"]
+            self._trained_size = state["trained_size"]
+            self._assignment[:len(assignment)] = assignment
+            # Rows appended after the state was saved
+            self._assignment[len(assignment):self._size] = self._assign(self._vectors[len(assignment):self._size])
+        super()._after_open(state)
+        if not restored:
+            self._maybe_train()
+
+    def _state(self):
+        state = super()._state()
+        if self.is_trained:
+            state.update({
+                "nlist": self.nlist,
+                "centroids": self.centroids,
+                "assignment": self._assignment[:self._size],
+                "trained_size": self._trained_size
+            })
+        return state
+
+    def _after_add(self, start, end):
+        if self.is_trained:
+            self._assignment[start:end] = self._assign(self._vectors[start:end])
+            self._lists = None
+        # Codes first: retraining the IVF lists may compact the rows
+        super()._after_add(start, end)
+        # add() holds the lock: train in the background so searches are not blocked meanwhile
+        self._maybe_train(background=True)
+
+    def _maybe_train(self, background=False):
+        if self._training or len(self) < max(self.min_train_size, 4 * self._trained_size):
+            return
+        # Train on first reaching the threshold and retrain as the corpus grows
+        if background:
+            self._training = True
+            threading.Thread(target=self._train_in_background, daemon=True, name="ivf-train").start()
+        else:
+            self.train()
+
+    def _train_in_background(self):
+        try:
+            self.train()
+        finally:
+            self._training = False
+
+    def _remove_row(self, row):
+        super()._remove_row(row)
+        self._lists = None
+
+    def _compact(self):
+        keep = super()._compact()
+        self._generation += 1
+        self._assignment = self._assignment[keep]
+        self._lists = None
+        return keep
+
+    def _assign(self, matrix, centroids=None, batch_size=65536):
+        centroids = self.centroids if centroids is None else centroids
+        assignment = np.empty(len(matrix), dtype=np.int32)
+        for start in range(0, len(matrix), batch_size):
+            batch = matrix[start:start + batch_size]
+            assignment[start:start + batch_size] = np.argmax(batch @ centroids.T, axis=1)
+        return assignment
+
+    def train(self):
+        """(Re)build the coarse quantizer from the vectors currently stored.
+
+        k-means and the assignment of every row run on copies of the rows
+        without holding the lock, so searches and adds go on meanwhile; rows
+        added in the meantime are assigned when the new centroids are swapped in.
+        No view of the vector map is kept across unlocked work: an add may grow
+        (truncate) the mapped file, which fails on Windows while a view is open.
+        """
+        with self._lock:
+            if self._dead:
+                self._compact()
+            if self._size == 0:
+                return
+            size, generation = self._size, self._generation
+            # Rows below `size` are never rewritten in place, only compaction moves them
+            if size > self.train_sample_size:
+                rows = np.sort(np.random.default_rng(0).choice(size, self.train_sample_size, replace=False))
+                sample = self._vectors[rows]  # Fancy indexing copies
+            else:
+                sample = np.array(self._vectors[:size])
+        nlist = self.nlist or max(1, int(4 * np.sqrt(size)))
+        centroids = spherical_kmeans(sample, nlist, self.kmeans_iterations)
+        del sample
+        assignment = np.empty(size, dtype=np.int32)
+        for start in range(0, size, self.train_block_size):
+            end = min(start + self.train_block_size, size)
+            with self._lock:
+                if self._generation != generation:
+                    break
+                block = np.array(self._vectors[start:end])
+            assignment[start:end] = self._assign(block, centroids)
+        with self._lock:
+            if self._size == 0:
+                return
+            if self._generation != generation:
+                # Compacted or cleared meanwhile, the snapshot rows no longer line up
+                assignment = self._assign(self._vectors[:self._size], centroids)
+            elif self._size > size:
+                assignment = np.concatenate([assignment, self._assign(self._vectors[size:self._size], centroids)])
+            self.centroids = centroids
+            self._assignment[:self._size] = assignment
+            self._trained_size = size
+            self._lists = None
+            self.save()
+
+    def _inverted_lists(self):
+        if self._lists is None:
+            rows = np.flatnonzero(self._alive[:self._size])
+            order = np.argsort(self._assignment[rows], kind="stable")
+            rows = rows[order]
+            bounds = np.searchsorted(self._assignment[rows], np.arange(len(self.centroids) + 1))
+            self._lists = [rows[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+        return self._lists
+
+    def search_batch(self, queries, k=5, nprobe=None, exact=False):
+        """Search a (m, dim) matrix of queries, returns one result list per query"""
+        matrix = normalize(queries)
+        with self._lock:
+            if len(self) == 0:
+                return [[] for _ in range(len(matrix))]
+            if exact or not self.is_trained:
+                return self._exact_search(matrix, k)
+            nprobe = min(nprobe or self.nprobe, len(self.centroids))
+            lists = self._inverted_lists()
+            centroid_scores = matrix @ self.centroids.T
+            probes = [top_k(centroid_scores[j], nprobe) for j in range(len(matrix))]
+            if len(matrix) > 1 and self.quantizer is None:
+                return self._search_lists(matrix, probes, lists, k)
+            results = []
+            for j, q in enumerate(matrix):
+                rows = np.concatenate([lists[i] for i in probes[j]])
+                if self.quantizer is not None:
+                    results.append(self._quantized_search(q, k, rows))
+                else:
+                    results.append(self._results(self._vectors[rows] @ q, rows, k))
+            return results
+
+    def _search_lists(self, matrix, probes, lists, k):
+        """Score a batch list by list: the rows of each probed list are gathered once and
+        scored against every query that probes it with one matrix-matrix product"""
+        queries_by_list = {}
+        for j, probed in enumerate(probes):
+            for i in probed:
+                queries_by_list.setdefault(int(i), []).append(j)
+        candidates = [[] for _ in range(len(matrix))]
+        for i, queries in queries_by_list.items():
+            rows = lists[i]
+            if len(rows) == 0:
+                continue
+            scores = self._vectors[rows] @ matrix[queries].T
+            for column, j in enumerate(queries):
+                best = top_k(scores[:, column], k)
+                candidates[j].append((scores[best, column], rows[best]))
+        results = []
+        for found in candidates:
+            if not found:
+                results.append([])
+                continue
+            results.append(self._results(np.concatenate([scores for scores, _ in found]),
+                                         np.concatenate([rows for _, rows in found]), k))
+        return results
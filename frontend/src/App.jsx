@@ -171,9 +171,21 @@ function App() {
     }
 
     try {
-      await axios.post(`${API_URL}/upload`, formData, {
+      const res = await axios.post(`${API_URL}/upload`, formData, {
         headers: { 'Content-Type': 'multipart/form-data' }
       })
+      // Ingestion runs in the background, poll the job until it finishes
+      let job = { status: res.data.status }
+      while (job.status !== 'completed' && job.status !== 'failed') {
+        await new Promise(resolve => setTimeout(resolve, 1000))
+        job = (await axios.get(`${API_URL}/jobs/${res.data.job_id}`)).data
+        if (job.chunks_total) {
+          setUploadStatus(`Embedding ${file.name}: ${job.chunks_done}/${job.chunks_total} chunks (${job.chunks_per_second} chunks/sec)`)
+        }
+      }
+      if (job.status === 'failed') {
+        throw new Error(job.error)
+      }
       setUploadStatus(`Successfully processed ${file.name}`)
       setTimeout(() => setUploadStatus(''), 3000)
       fetchCollectionStats() // Refresh stats after upload
@@ -206,10 +218,42 @@ function App() {
         requestBody.collection_filter = collectionFilter
       }
 
-      const res = await axios.post(`${API_URL}/chat`, requestBody)
+      // Stream the answer: context arrives first, then tokens as they are generated
+      const res = await fetch(`${API_URL}/chat/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(requestBody)
+      })
+      if (!res.ok) throw new Error(`HTTP ${res.status}`)
 
-      const botMsg = { role: 'bot', content: res.data.response, context: res.data.context }
-      setMessages(prev => [...prev, botMsg])
+      const updateBotMsg = (update) => setMessages(prev => {
+        const last = prev[prev.length - 1]
+        return [...prev.slice(0, -1), { ...last, ...update(last) }]
+      })
+      setMessages(prev => [...prev, { role: 'bot', content: '', context: [] }])
+
+      const reader = res.body.getReader()
+      const decoder = new TextDecoder()
+      let buffer = ''
+      while (true) {
+        const { done, value } = await reader.read()
+        if (done) break
+        buffer += decoder.decode(value, { stream: true })
+        const lines = buffer.split('\n')
+        buffer = lines.pop()
+        for (const line of lines) {
+          if (!line.trim()) continue
+          const event = JSON.parse(line)
+          if (event.type === 'context') {
+            updateBotMsg(() => ({ context: event.context }))
+          } else if (event.type === 'token') {
+            updateBotMsg(last => ({ content: last.content + event.content }))
+          } else if (event.type === 'error') {
+            // Keep whatever was generated before the failure
+            updateBotMsg(last => ({ content: `${last.content}${last.content ? '\n\n' : ''}Error: ${event.detail}` }))
+          }
+        }
+      }
     } catch (err) {
       setMessages(prev => [...prev, { role: 'bot', content: 'Error: Could not get response.' }])
     } finally {